@@ -0,0 +1,215 @@
+"""Micro-benchmarks for the game engine.
+
+Run with ``python bench.py <name>`` or ``python bench.py all``.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import timeit
+
+from game_map import load_map
+from server import MAPS, MAPS_DIR, DIRECTIONS, TICK_INTERVAL, AIGhost, GameRoom
+
+CLASSIC_MAP = MAPS["classic"]
+RAW_MAP = CLASSIC_MAP.rows
+
+# ===== MAP LOOKUPS =====
+# The string-indexing helpers the engine used before CompiledMap, kept as the baseline
+def legacy_is_wall(x, y):
+    if y < 0 or y >= len(RAW_MAP) or x < 0 or x >= len(RAW_MAP[0]):
+        return True
+    return RAW_MAP[y][x] == "#"
+
+def legacy_wrap_position(x, y):
+    if x < 0:
+        return len(RAW_MAP[0]) - 1, y
+    if x >= len(RAW_MAP[0]):
+        return 0, y
+    return x, y
+
+def legacy_neighbors(x, y):
+    """Walkable neighbors the way move_ai_ghost used to find them"""
+    result = []
+    for dx, dy in DIRECTIONS.values():
+        nx, ny = legacy_wrap_position(x + dx, y + dy)
+        if 0 <= ny < len(RAW_MAP) and 0 <= nx < len(RAW_MAP[0]):
+            if not legacy_is_wall(nx, ny):
+                result.append((nx, ny))
+    return result
+
+def compiled_neighbors(x, y):
+    cmap = CLASSIC_MAP
+    return [cmap.position(i) for i in cmap.neighbors[cmap.index(x, y)]]
+
+def bench_map(number):
+    cells = [(x, y) for y in range(len(RAW_MAP)) for x in range(len(RAW_MAP[0])) if RAW_MAP[y][x] != "#"]
+    assert all(legacy_neighbors(x, y) == compiled_neighbors(x, y) for x, y in cells)
+
+    def run_legacy():
+        for x, y in cells:
+            legacy_neighbors(x, y)
+
+    def run_compiled():
+        for x, y in cells:
+            compiled_neighbors(x, y)
+
+    def run_compiled_index():
+        neighbors = CLASSIC_MAP.neighbors
+        for x, y in cells:
+            neighbors[CLASSIC_MAP.index(x, y)]
+
+    print(f"Neighbor lookup over {len(cells)} open cells, {number} passes")
+    for name, fn in [("legacy helpers", run_legacy),
+                     ("compiled map (x, y)", run_compiled),
+                     ("compiled map (index)", run_compiled_index)]:
+        seconds = timeit.timeit(fn, number=number)
+        print(f"  {name:<22} {seconds / (number * len(cells)) * 1e9:8.1f} ns/cell")
+
+# ===== MAP LOADING =====
+def tiled_map_text(copies):
+    """The classic map repeated copies x copies times, tunnels only on the outer edges"""
+    row_block = []
+    for row in RAW_MAP:
+        inner = row.replace("T", " ")
+        row_block.append(row[0] + (inner * copies)[1:-1] + row[-1])
+    grid = "\n".join(row_block * copies)
+    return grid + "\n\npacman: 1,1\nghost: 12,14\n"
+
+def bench_load(number):
+    print(f"Map load time, compiled vs cached, best of {number}")
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = [("classic", os.path.join(MAPS_DIR, "classic.txt"))]
+        for copies in (2, 4):
+            path = os.path.join(tmp, f"tiled{copies}.txt")
+            with open(path, "w") as f:
+                f.write(tiled_map_text(copies))
+            sources.append((f"tiled {copies}x{copies}", path))
+        for name, path in sources:
+            compiled = min(timeit.repeat(lambda: load_map(path, use_cache=False), number=1, repeat=number))
+            load_map(path)  # Make sure the cache file exists
+            cached = min(timeit.repeat(lambda: load_map(path), number=1, repeat=number))
+            cmap = load_map(path)
+            print(f"  {name:<12} {cmap.width:4d}x{cmap.height:<4d} compile {compiled * 1e3:8.2f} ms  "
+                  f"cached {cached * 1e3:8.2f} ms")
+
+# ===== WIRE PROTOCOL =====
+def make_room(pacmen=1, ghosts=4):
+    """Room with socketless players, ready for game_tick"""
+    room = GameRoom("bench")
+    for i in range(pacmen + ghosts):
+        sid = f"s{i}"
+        room.lobby.join(sid, None)
+        room.lobby.set_role(sid, "Pac-Man" if i < pacmen else "Ghost")
+        room.add_player(sid, None)
+    return room
+
+def step_room(room, rng):
+    """One tick with a random move queued for every player"""
+    room.clock.set(room.clock() + TICK_INTERVAL)
+    for sid, player in room.players.items():
+        player.last_move_time = 0
+        room.queue_move(sid, rng.choice(list(DIRECTIONS)))
+    room.game_tick()
+
+def bench_protocol(number):
+    # Same separators starlette uses in send_json
+    def encode_json(message):
+        return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+
+    formats = {
+        "json": (GameRoom.build_json_messages, encode_json),
+        "binary": (GameRoom.build_binary_messages, bytes),
+    }
+    print(f"Encode cost and size over {number} ticks (1 Pac-Man, 4 ghosts, 4 AI ghosts)")
+    for name, (build, encode) in formats.items():
+        room = make_room()
+        rng = random.Random(42)
+        build(room)  # Baseline frame
+        encode_seconds = 0.0
+        delta_bytes = 0
+        for _ in range(number):
+            step_room(room, rng)
+            start = time.perf_counter()
+            delta, make_keyframe, _ = build(room)
+            if delta:
+                delta_bytes += len(encode(delta))
+            encode_seconds += time.perf_counter() - start
+        keyframe_bytes = len(encode(make_keyframe()))
+        print(f"  {name:<7} {encode_seconds / number * 1e6:8.1f} us/tick  "
+              f"{delta_bytes / number:8.1f} B/tick delta  {keyframe_bytes:6d} B keyframe")
+
+# ===== AI GHOSTS =====
+def bench_ai(number, ghost_counts=(4, 16, 64, 256, 512)):
+    print(f"AI ghost passes in chase mode, {number} passes, tick budget {TICK_INTERVAL * 1e3:.0f} ms")
+    for count in ghost_counts:
+        room = make_room(pacmen=2, ghosts=0)
+        room.ghost_mode = "chase"
+        spawns = room.ai_ghosts
+        room.ai_ghosts = []
+        for slot in range(count):
+            spawn = spawns[slot % len(spawns)]
+            room.ai_ghosts.append(AIGhost(slot, spawn.x, spawn.y, spawn.char))
+        rng = random.Random(7)
+        pacmen = room.pacmen
+        start = time.perf_counter()
+        for _ in range(number):
+            # Move the Pac-Men so chase targets keep changing
+            for player in pacmen:
+                player.last_move_time = 0
+                room.move_player(player, rng.choice(list(DIRECTIONS)))
+            room.move_ai_ghosts()
+        seconds = time.perf_counter() - start
+        print(f"  {count:4d} ghosts  {seconds / number * 1e3:8.3f} ms/pass  "
+              f"{len(room.map._distance_cache)} cached distance fields")
+
+# ===== HEADLESS SIMULATION =====
+def bench_sim(number):
+    from simulate import Simulation
+
+    ticks = number * 10
+    print(f"Headless simulation ticks/s over {ticks} ticks, bot players, no broadcasts")
+
+    def report(label, **settings):
+        sim = Simulation(seed=1, **settings)
+        result = sim.run(ticks)
+        print(f"  {label:<28} {result['ticks_per_second']:9.0f} ticks/s  "
+              f"{result['seconds'] / ticks * 1e6:8.1f} us/tick")
+
+    print(" players (Pac-Men + ghosts), classic map")
+    for pacmen, ghosts in ((1, 4), (2, 8), (5, 20)):
+        report(f"{pacmen} + {ghosts}", pacmen=pacmen, ghosts=ghosts)
+    print(" AI ghosts, 1 + 4 players, classic map")
+    for count in (4, 16, 64, 512):
+        report(f"{count} AI ghosts", ai_ghosts=count)
+    print(" map size, 1 + 4 players, 4 AI ghosts")
+    with tempfile.TemporaryDirectory() as tmp:
+        sizes = [("classic", CLASSIC_MAP)]
+        for copies in (2, 4):
+            path = os.path.join(tmp, f"tiled{copies}.txt")
+            with open(path, "w") as f:
+                f.write(tiled_map_text(copies))
+            sizes.append((f"bench-tiled{copies}", load_map(path)))
+        for name, cmap in sizes:
+            MAPS.setdefault(name, cmap)
+            report(f"{name} {cmap.width}x{cmap.height}", map_name=name, ai_ghosts=4)
+
+BENCHMARKS = {
+    "ai": bench_ai,
+    "load": bench_load,
+    "map": bench_map,
+    "protocol": bench_protocol,
+    "sim": bench_sim,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("name", choices=sorted(BENCHMARKS) + ["all"])
+    parser.add_argument("-n", "--number", type=int, default=200, help="passes per benchmark")
+    args = parser.parse_args()
+
+    names = sorted(BENCHMARKS) if args.name == "all" else [args.name]
+    for name in names:
+        BENCHMARKS[name](args.number)
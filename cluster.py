@@ -0,0 +1,370 @@
+"""Run the game across several worker processes behind one routing front.
+
+Each worker is an ordinary ``uvicorn server:app`` process on a private port,
+so every worker owns its rooms, lobbies and tick tasks outright. The router is
+the only public listener and forwards connections:
+
+* ``/ws/{session_id}`` goes to the worker named in the session id. Workers
+  mint ids as ``w<worker>-<uuid>``, so this needs no shared state and the same
+  session always lands on the same worker.
+* ``/watch/{room_id}`` goes the same way; room ids carry the same prefix.
+* ``/lobby`` goes to the worker currently filling a room for the requested
+  map. When the router sees that room's ``start_game`` go past, the next room
+  for that map is placed on the next worker, so new rooms rotate over every
+  core.
+
+Examples:
+    python cluster.py --workers 4 --port 8000
+    WORKERS=4 python server.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+import websockets
+from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, PlainTextResponse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKER_HOST = "127.0.0.1"
+WORKER_START_TIMEOUT = 30  # Seconds to wait for a worker to answer HTTP
+MONITOR_INTERVAL = 1.0  # Seconds between checks for dead workers
+RESTART_BACKOFF_MAX = 60.0  # Longest wait between attempts to restart a worker that keeps failing
+
+
+# ===== WORKERS =====
+class Worker:
+    """One ``uvicorn server:app`` child process"""
+
+    def __init__(self, worker_id, port):
+        self.worker_id = worker_id
+        self.port = port
+        self.proc = None
+        self.restarts = 0
+        self.backoff = 0.0  # Seconds to wait after the next failed restart, 0 once one succeeds
+        self.retry_at = 0.0
+
+    @property
+    def http_url(self):
+        return f"http://{WORKER_HOST}:{self.port}"
+
+    @property
+    def ws_url(self):
+        return f"ws://{WORKER_HOST}:{self.port}"
+
+    def start(self):
+        env = dict(os.environ, WORKER_ID=str(self.worker_id))
+        env.pop("WORKERS", None)
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", WORKER_HOST, "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=BASE_DIR, env=env)
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def wait_ready(self):
+        deadline = time.time() + WORKER_START_TIMEOUT
+        while time.time() < deadline:
+            if not self.alive():
+                raise RuntimeError(f"worker {self.worker_id} exited with code {self.proc.returncode}")
+            try:
+                urllib.request.urlopen(f"{self.http_url}/maps", timeout=1)
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"worker {self.worker_id} did not start")
+
+    def stop(self):
+        if self.alive():
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+workers: List[Worker] = []
+filling: Dict[str, int] = {}  # map name -> worker currently filling a room for it
+
+
+def worker_for_session(session_id):
+    """Worker that minted ``session_id``, or None if it isn't one of ours"""
+    prefix = session_id.split("-", 1)[0]
+    if prefix[:1] != "w" or not prefix[1:].isdigit():
+        return None
+    worker_id = int(prefix[1:])
+    return workers[worker_id] if worker_id < len(workers) else None
+
+
+def room_started(map_name, worker):
+    """A room for ``map_name`` started on ``worker``; place the next one elsewhere"""
+    if filling.get(map_name, 0) == worker.worker_id:
+        filling[map_name] = (worker.worker_id + 1) % len(workers)
+
+
+async def monitor_workers():
+    """Restart workers that die; their rooms are lost but new ones can land there again"""
+    while True:
+        await asyncio.sleep(MONITOR_INTERVAL)
+        for worker in workers:
+            if worker.alive() or time.monotonic() < worker.retry_at:
+                continue
+            print(f"worker {worker.worker_id} exited with code {worker.proc.returncode}, restarting")
+            worker.restarts += 1
+            try:
+                worker.start()
+                await asyncio.to_thread(worker.wait_ready)
+                worker.backoff = 0.0
+            except (OSError, RuntimeError) as e:
+                # Port still in TIME_WAIT, a map that crashes startup...; keep watching the others
+                worker.backoff = min(max(worker.backoff * 2, MONITOR_INTERVAL), RESTART_BACKOFF_MAX)
+                worker.retry_at = time.monotonic() + worker.backoff
+                print(f"worker {worker.worker_id} failed to restart: {e}; retrying in {worker.backoff:.0f} s")
+                await asyncio.to_thread(worker.stop)  # One that hung before answering counts as dead
+
+
+# ===== ROUTER =====
+@asynccontextmanager
+async def lifespan(app):
+    monitor = asyncio.create_task(monitor_workers())
+    try:
+        yield
+    finally:
+        monitor.cancel()
+
+
+router = FastAPI(title="ASCII Pac-Man Multiplayer - Router", lifespan=lifespan)
+
+
+def fetch_json(url):
+    with urllib.request.urlopen(url, timeout=5) as resp:
+        return json.load(resp)
+
+
+def fetch_text(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        return resp.read().decode()
+
+
+def label_samples(text, worker_id):
+    """Add worker="<id>" to every sample line of a Prometheus text page"""
+    lines = []
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            if name.endswith("}"):
+                name = f'{name[:-1]},worker="{worker_id}"}}'
+            else:
+                name = f'{name}{{worker="{worker_id}"}}'
+            line = f"{name} {value}"
+        lines.append(line)
+    return lines
+
+
+async def gather_json(path):
+    """The same GET from every worker, in worker order"""
+    return await asyncio.gather(*(asyncio.to_thread(fetch_json, worker.http_url + path) for worker in workers))
+
+
+@router.get("/")
+async def index():
+    return FileResponse(os.path.join(BASE_DIR, "index.html"))
+
+
+@router.get("/maps")
+async def list_maps():
+    # Every worker loads the same maps directory
+    return await asyncio.to_thread(fetch_json, workers[0].http_url + "/maps")
+
+
+@router.get("/rooms")
+async def list_rooms():
+    return [room for rooms in await gather_json("/rooms") for room in rooms]
+
+
+@router.get("/stats/tick")
+async def get_tick_stats():
+    # Room ids carry their worker prefix, so per-worker dicts never collide
+    return {room_id: stats for per_worker in await gather_json("/stats/tick") for room_id, stats in per_worker.items()}
+
+
+@router.get("/stats/connections")
+async def get_connection_stats():
+    return {room_id: stats for per_worker in await gather_json("/stats/connections")
+            for room_id, stats in per_worker.items()}
+
+
+@router.get("/leaderboard")
+async def get_leaderboard(map_name: str = Query("", alias="map"), limit: int = 10):
+    # Each worker keeps its own results; merge their tops
+    query = urllib.parse.urlencode({"map": map_name, "limit": limit})
+    entries = [entry for top in await gather_json(f"/leaderboard?{query}") for entry in top]
+    entries.sort(key=lambda entry: (-entry["score"], entry["ended_at"]))
+    return entries[:limit]
+
+
+@router.get("/metrics")
+async def get_metrics():
+    pages = await asyncio.gather(*(asyncio.to_thread(fetch_text, worker.http_url + "/metrics") for worker in workers))
+    # Keep one HELP/TYPE header per family and every worker's samples under it
+    families = {}
+    for worker, page in zip(workers, pages):
+        family = None
+        for line in label_samples(page, worker.worker_id):
+            if line.startswith("# HELP "):
+                family = line.split(" ", 3)[2]
+                families.setdefault(family, [line])
+            elif line.startswith("# TYPE "):
+                if len(families[family]) == 1:
+                    families[family].append(line)
+            elif line:
+                families[family].append(line)
+    text = "\n".join(line for lines in families.values() for line in lines) + "\n"
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+@router.get("/debug/profile")
+async def get_profile(worker: int = 0, seconds: float = 10.0, interval_ms: float = 5.0):
+    target = workers[worker % len(workers)]
+    url = f"{target.http_url}/debug/profile?seconds={seconds}&interval_ms={interval_ms}"
+    try:
+        text = await asyncio.to_thread(fetch_text, url, seconds + 10)
+    except urllib.error.HTTPError as e:
+        return PlainTextResponse(e.read().decode(), status_code=e.code)
+    return PlainTextResponse(text)
+
+
+@router.get("/workers")
+async def list_workers():
+    return [
+        {"worker_id": w.worker_id, "port": w.port, "alive": w.alive(), "restarts": w.restarts}
+        for w in workers
+    ]
+
+
+async def proxy(client: WebSocket, upstream_url, on_message=None):
+    """Pump frames both ways between an accepted client socket and a worker"""
+    try:
+        upstream = await websockets.connect(upstream_url, max_size=None)
+    except (OSError, websockets.InvalidHandshake):
+        await client.close(code=1013)  # Try again later
+        return
+
+    async def client_to_upstream():
+        try:
+            while True:
+                message = await client.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                data = message.get("text")
+                await upstream.send(data if data is not None else message["bytes"])
+        except (WebSocketDisconnect, websockets.ConnectionClosed):
+            return
+
+    async def upstream_to_client():
+        try:
+            async for data in upstream:
+                if on_message is not None:
+                    on_message(data)
+                if isinstance(data, str):
+                    await client.send_text(data)
+                else:
+                    await client.send_bytes(data)
+        except (WebSocketDisconnect, websockets.ConnectionClosed, RuntimeError):
+            return
+
+    tasks = [asyncio.create_task(client_to_upstream()), asyncio.create_task(upstream_to_client())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await upstream.close()
+        # Pass the worker's close code on: the browser stops reconnecting on 1001 and 1008
+        code, reason = upstream.close_code, upstream.close_reason or ""
+        if code is None or code == 1006:  # Dropped without a close frame
+            code, reason = 1011, ""
+        elif code == 1005:  # Close frame without a code; 1005 itself can't be sent
+            code = 1000
+        try:
+            await client.close(code=code, reason=reason)
+        except (RuntimeError, WebSocketDisconnect):
+            pass  # Already closed, or the browser already went away
+
+
+@router.websocket("/lobby")
+async def lobby_ws(ws: WebSocket):
+    await ws.accept()
+    map_name = ws.query_params.get("map", "")
+    worker = workers[filling.setdefault(map_name, 0)]
+
+    def watch_start(data):
+        # Lobby traffic is small, so peeking at it is cheap
+        if isinstance(data, str) and '"start_game"' in data:
+            room_started(map_name, worker)
+
+    query = f"?{ws.url.query}" if ws.url.query else ""
+    await proxy(ws, f"{worker.ws_url}/lobby{query}", watch_start)
+
+
+@router.websocket("/ws/{session_id}")
+async def game_ws(ws: WebSocket, session_id: str):
+    await ws.accept()
+    worker = worker_for_session(session_id)
+    if worker is None:
+        await ws.send_text("Error: Invalid session")
+        await ws.close()
+        return
+    query = f"?{ws.url.query}" if ws.url.query else ""
+    await proxy(ws, f"{worker.ws_url}/ws/{session_id}{query}")
+
+
+@router.websocket("/watch/{room_id}")
+async def watch_ws(ws: WebSocket, room_id: str):
+    await ws.accept()
+    # Room ids carry the same w<worker>- prefix as session ids
+    worker = worker_for_session(room_id)
+    if worker is None:
+        await ws.send_text("Error: Unknown room")
+        await ws.close()
+        return
+    query = f"?{ws.url.query}" if ws.url.query else ""
+    await proxy(ws, f"{worker.ws_url}/watch/{room_id}{query}")
+
+
+# ===== SUPERVISOR =====
+def run(worker_count, port, host="0.0.0.0", base_port=None):
+    """Start ``worker_count`` workers, then serve the router on ``port`` until interrupted"""
+    import uvicorn
+
+    base_port = base_port or port + 1
+    workers[:] = [Worker(i, base_port + i) for i in range(worker_count)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.wait_ready()
+        uvicorn.run(router, host=host, port=port)
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: one per core)")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)), help="public router port")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--base-port", type=int, help="first worker port (default: port + 1)")
+    args = parser.parse_args()
+    run(args.workers, args.port, args.host, args.base_port)
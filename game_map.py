@@ -0,0 +1,395 @@
+import hashlib
+import os
+import struct
+from array import array
+from collections import OrderedDict, deque
+from typing import Dict, List, Tuple
+
+# ===== CELL CODES =====
+WALL = "#"
+TUNNEL = "T"
+PEN = "G"
+PELLET = "."
+POWER_PELLET = "@"
+
+MAP_CHARS = frozenset(" #.@GT-")
+
+DIRECTION_ORDER = ("up", "down", "left", "right")
+DIRECTION_DELTAS = {"up": (0, -1), "down": (0, 1), "left": (-1, 0), "right": (1, 0)}
+
+# ===== PATHFINDING =====
+UNREACHABLE = 1 << 30
+DISTANCE_CACHE_CELLS = 4 * 1024 * 1024  # Cached distance field cells per map (4 bytes each), least recently used evicted
+
+# ===== MAP FILES =====
+MAP_SUFFIX = ".txt"
+CACHE_DIR = "__pycache__"  # Compiled tables live next to the maps, like .pyc files
+CACHE_SUFFIX = ".pmap"
+# magic, format version, int size, sha256 of the map file, width, height
+CACHE_HEADER = struct.Struct("<4sHB32sHH")
+CACHE_MAGIC = b"PMAP"
+CACHE_VERSION = 1
+POINT_KEYS = ("pacman", "ghost", "pen_exit", "ai_ghost", "scatter", "patrol", "home")
+
+
+class MapError(ValueError):
+    """A map file that is malformed or can't be played"""
+
+
+def _flag_table(char):
+    """bytes.translate table mapping ``char`` to 1 and every other byte to 0"""
+    return bytes(b == ord(char) for b in range(256))
+
+
+class CompiledMap:
+    """Static lookup tables built once from a raw map.
+
+    Cells are addressed by flat index ``y * width + x``. Walls, tunnels and the
+    ghost pen are bytearrays, and ``moves[direction][i]`` holds the cell reached
+    by stepping that way from ``i`` (tunnel wrap included) or -1 if it is blocked.
+
+    BFS distance fields toward a target cell are computed on demand and cached
+    on the map. A map never changes once compiled, so the cache never needs
+    invalidating; a changed map is a new CompiledMap with an empty cache.
+
+    ``points`` holds the spawn and AI target lists parsed from a map file, and
+    ``tables`` the ``(moves, nearest_open)`` pair from a compiled cache file.
+    """
+
+    def __init__(self, rows, name="map", points=None, tables=None):
+        self.name = name
+        self.rows = tuple(rows)
+        self.height = len(self.rows)
+        self.width = len(self.rows[0])
+        self.size = self.width * self.height
+
+        flat = "".join(self.rows)
+        flat_bytes = flat.encode("ascii")
+        self.walls = bytearray(flat_bytes.translate(_flag_table(WALL)))
+        self.tunnels = bytearray(flat_bytes.translate(_flag_table(TUNNEL)))
+        self.pen = bytearray(flat_bytes.translate(_flag_table(PEN)))
+
+        # Cells that can ever be empty floor (fruit can spawn there once cleared)
+        self.floor_cells = [i for i, cell in enumerate(flat) if cell in (" ", PELLET, POWER_PELLET)]
+        self.pellet_cells = [i for i, cell in enumerate(flat) if cell in (PELLET, POWER_PELLET)]
+
+        # Fresh board as newline-separated rows; rooms copy it and edit cells in place
+        self.board_stride = self.width + 1
+        self.board = "\n".join(self.rows).encode("ascii")
+
+        # Per-direction step tables, -1 where the step hits a wall or leaves the map
+        if tables is not None:
+            self.moves, nearest_open = tables
+        else:
+            self.moves = {}
+            for direction in DIRECTION_ORDER:
+                dx, dy = DIRECTION_DELTAS[direction]
+                table = array("i", [-1]) * self.size
+                for i in range(self.size):
+                    y, x = divmod(i, self.width)
+                    j = self._step(x + dx, y + dy)
+                    if j >= 0:
+                        table[i] = j
+                self.moves[direction] = table
+
+        # Walkable neighbors of every cell, in DIRECTION_ORDER
+        is_open = (-1).__lt__
+        self.neighbors: List[Tuple[int, ...]] = [
+            tuple(filter(is_open, steps)) for steps in zip(*(self.moves[d] for d in DIRECTION_ORDER))
+        ]
+
+        self.nearest_open = nearest_open if tables is not None else self._build_nearest_open()
+        self._distance_cache = OrderedDict()
+        self._distance_cache_limit = max(1, DISTANCE_CACHE_CELLS // self.size)  # Fields, so big maps keep fewer
+        self._set_points(points or {})
+
+    def _set_points(self, points):
+        """Spawn points and AI targets, with defaults derived from the map size"""
+        w, h = self.width, self.height
+        corners = [(1, 1), (w - 2, 1), (1, h - 2), (w - 2, h - 2)]
+        qx, qy = w // 4, h // 4
+        self.pacman_spawns = points.get("pacman") or corners
+        self.ghost_spawns = points.get("ghost") or [self.position(i) for i in range(self.size) if self.pen[i]][:4]
+        self.pen_exits = points.get("pen_exit", [])
+        self.ai_ghost_spawns = points.get("ai_ghost", [])
+        self.scatter_targets = points.get("scatter") or corners
+        self.patrol_points = points.get("patrol") or [(qx, qy), (w - 1 - qx, qy), (w - 1 - qx, h - 1 - qy),
+                                                       (qx, h - 1 - qy)]
+        self.home = (points.get("home") or [(w // 2, h // 2)])[0]
+
+        if not self.ghost_spawns:
+            raise MapError(f"{self.name}: no ghost spawns and no pen to put them in")
+        for key, spawns in (("pacman", self.pacman_spawns), ("ghost", self.ghost_spawns),
+                            ("ai_ghost", self.ai_ghost_spawns)):
+            for x, y, *_ in spawns:
+                i = self.index(x, y)
+                if self.walls[i] or (key == "pacman" and self.pen[i]):
+                    raise MapError(f"{self.name}: {key} spawn {x},{y} is not walkable")
+
+    def _step(self, x, y):
+        """Flat index of (x, y) after tunnel wrap, or -1 if it's a wall"""
+        # Left tunnel wraps to right, right tunnel wraps to left
+        if x < 0:
+            x = self.width - 1
+        elif x >= self.width:
+            x = 0
+        if y < 0 or y >= self.height:
+            return -1
+        i = y * self.width + x
+        return -1 if self.walls[i] else i
+
+    def index(self, x, y):
+        return y * self.width + x
+
+    def position(self, i):
+        y, x = divmod(i, self.width)
+        return x, y
+
+    def step(self, x, y, direction):
+        """Cell index reached by moving from (x, y), or -1 if blocked"""
+        return self.moves[direction][y * self.width + x]
+
+    def block_walls(self, scale):
+        """1 for each ``scale`` x ``scale`` block that is solid wall, row-major"""
+        blocks_w = -(-self.width // scale)
+        blocks_h = -(-self.height // scale)
+        solid = bytearray([1]) * (blocks_w * blocks_h)
+        for i in range(self.size):
+            if not self.walls[i]:
+                y, x = divmod(i, self.width)
+                solid[(y // scale) * blocks_w + x // scale] = 0
+        return solid
+
+    def _build_nearest_open(self):
+        """For every cell, the closest cell in the main walkable region.
+
+        Targets can land on walls, off the map or in sealed-off pockets; they are
+        snapped to the nearest cell ghosts can actually reach.
+        """
+        # Largest connected walkable region is the maze proper
+        seen = bytearray(self.size)
+        main = []
+        for start in range(self.size):
+            if self.walls[start] or seen[start]:
+                continue
+            seen[start] = 1
+            region = [start]
+            for i in region:
+                for j in self.neighbors[i]:
+                    if not seen[j]:
+                        seen[j] = 1
+                        region.append(j)
+            if len(region) > len(main):
+                main = region
+
+        # Multi-source BFS over the plain grid, ignoring walls
+        nearest = array("i", [-1]) * self.size
+        queue = deque(main)
+        for i in main:
+            nearest[i] = i
+        while queue:
+            i = queue.popleft()
+            y, x = divmod(i, self.width)
+            for nx, ny in ((x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)):
+                if 0 <= nx < self.width and 0 <= ny < self.height:
+                    j = ny * self.width + nx
+                    if nearest[j] < 0:
+                        nearest[j] = nearest[i]
+                        queue.append(j)
+        return nearest
+
+    def target_cell(self, x, y):
+        """Snap an arbitrary target position to a reachable cell index"""
+        x = min(max(x, 0), self.width - 1)
+        y = min(max(y, 0), self.height - 1)
+        return self.nearest_open[y * self.width + x]
+
+    def distance_field(self, target):
+        """BFS step counts from every cell to ``target`` (UNREACHABLE if cut off).
+
+        Moves are symmetric (tunnels wrap both ways), so a BFS outward from the
+        target gives the distance from each cell to it.
+        """
+        cache = self._distance_cache
+        field = cache.get(target)
+        if field is not None:
+            cache.move_to_end(target)
+            return field
+
+        field = array("i", [UNREACHABLE]) * self.size
+        field[target] = 0
+        queue = deque([target])
+        neighbors = self.neighbors
+        while queue:
+            i = queue.popleft()
+            next_dist = field[i] + 1
+            for j in neighbors[i]:
+                if field[j] == UNREACHABLE:
+                    field[j] = next_dist
+                    queue.append(j)
+
+        cache[target] = field
+        if len(cache) > self._distance_cache_limit:
+            cache.popitem(last=False)
+        return field
+
+    def next_step(self, start, target):
+        """Neighbor of ``start`` on a shortest path to ``target`` (``start`` if already there)"""
+        field = self.distance_field(target)
+        if field[start] == 0:
+            return start
+        options = self.neighbors[start]
+        if not options:
+            return start
+        return min(options, key=field.__getitem__)
+
+    def next_steps(self, starts, target):
+        """``next_step`` for many start cells sharing one target, with one distance field lookup.
+
+        Cells with no walkable neighbor get -1: the ghost has nowhere to go.
+        """
+        field = self.distance_field(target)
+        distance = field.__getitem__
+        neighbors = self.neighbors
+        steps = []
+        for start in starts:
+            options = neighbors[start]
+            if not options:
+                steps.append(-1)
+            elif field[start] == 0:
+                steps.append(start)
+            else:
+                steps.append(min(options, key=distance))
+        return steps
+
+
+# ===== MAP LOADING =====
+def parse_map(text, name="map"):
+    """Split a map file into grid rows and spawn/target points.
+
+    The grid comes first; short rows are padded with empty floor. After the
+    first blank line come ``key: x,y x,y ...`` lines (``x,y,C`` for AI ghosts,
+    ``#`` starts a comment) for the keys in POINT_KEYS.
+    """
+    grid, _, meta = text.partition("\n\n")
+    rows = grid.strip("\n").split("\n") if grid.strip() else []
+    if not rows:
+        raise MapError(f"{name}: empty map")
+    width = max(len(row) for row in rows)
+    rows = [row.ljust(width) for row in rows]
+
+    for y, row in enumerate(rows):
+        unknown = set(row) - MAP_CHARS
+        if unknown:
+            cell = min(unknown, key=row.index)
+            raise MapError(f"{name}: unknown cell {cell!r} at {row.index(cell)},{y}")
+        x = row.find(TUNNEL, 1, width - 1)
+        if x >= 0:
+            raise MapError(f"{name}: tunnel at {x},{y} is not on the left or right edge")
+    if not any(PELLET in row or POWER_PELLET in row for row in rows):
+        raise MapError(f"{name}: no pellets to eat")
+
+    points = {}
+    for line_no, line in enumerate(meta.split("\n"), start=len(rows) + 2):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        key, sep, values = line.partition(":")
+        key = key.strip()
+        if not sep or key not in POINT_KEYS:
+            raise MapError(f"{name}:{line_no}: expected one of {', '.join(POINT_KEYS)} followed by ':'")
+        parsed = []
+        for value in values.split():
+            fields = value.split(",")
+            try:
+                x, y = int(fields[0]), int(fields[1])
+            except (ValueError, IndexError):
+                raise MapError(f"{name}:{line_no}: bad point {value!r}")
+            if not (0 <= x < width and 0 <= y < len(rows)):
+                raise MapError(f"{name}:{line_no}: point {x},{y} is off the map")
+            if key == "ai_ghost":
+                if len(fields) != 3 or len(fields[2]) != 1 or not fields[2].isupper():
+                    raise MapError(f"{name}:{line_no}: AI ghosts need x,y,LETTER, got {value!r}")
+                parsed.append((x, y, fields[2]))
+            else:
+                parsed.append((x, y))
+        points[key] = parsed
+    return rows, points
+
+
+def _cache_path(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, CACHE_DIR, os.path.splitext(filename)[0] + CACHE_SUFFIX)
+
+
+def _read_tables(cache_path, digest, width, height):
+    """(moves, nearest_open) from a cache file, or None if it is missing or stale"""
+    try:
+        with open(cache_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    size = width * height
+    itemsize = array("i").itemsize
+    if len(data) != CACHE_HEADER.size + (len(DIRECTION_ORDER) + 1) * size * itemsize:
+        return None
+    if CACHE_HEADER.unpack_from(data) != (CACHE_MAGIC, CACHE_VERSION, itemsize, digest, width, height):
+        return None
+
+    tables = []
+    offset = CACHE_HEADER.size
+    for _ in range(len(DIRECTION_ORDER) + 1):
+        table = array("i")
+        table.frombytes(data[offset:offset + size * itemsize])
+        tables.append(table)
+        offset += size * itemsize
+    return dict(zip(DIRECTION_ORDER, tables)), tables[-1]
+
+
+def _write_tables(cache_path, digest, cmap):
+    """Best effort: a read-only maps directory just means compiling every time"""
+    header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, array("i").itemsize, digest, cmap.width, cmap.height)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            for direction in DIRECTION_ORDER:
+                f.write(cmap.moves[direction].tobytes())
+            f.write(cmap.nearest_open.tobytes())
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+
+def load_map(path, use_cache=True):
+    """Parse, validate and compile one map file.
+
+    The step and nearest-cell tables are the slow part of compiling, so they
+    are cached in binary next to the map and reused while the file's hash
+    still matches.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "rb") as f:
+        source = f.read()
+    rows, points = parse_map(source.decode("ascii"), name)
+
+    digest = hashlib.sha256(source).digest()
+    cache_path = _cache_path(path)
+    tables = _read_tables(cache_path, digest, len(rows[0]), len(rows)) if use_cache else None
+    cmap = CompiledMap(rows, name, points, tables)
+    if use_cache and tables is None:
+        _write_tables(cache_path, digest, cmap)
+    return cmap
+
+
+def load_maps(directory, use_cache=True) -> Dict[str, CompiledMap]:
+    """Every map file in a directory, keyed by file name without the suffix"""
+    maps = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(MAP_SUFFIX):
+            cmap = load_map(os.path.join(directory, filename), use_cache)
+            maps[cmap.name] = cmap
+    if not maps:
+        raise MapError(f"no {MAP_SUFFIX} maps in {directory}")
+    return maps
@@ -0,0 +1,327 @@
+"""Load generator for the game server.
+
+Scripted bots go through the real /lobby -> /ws/{session_id} flow, one room at
+a time, then hold arrow keys at a configurable rate and restart each game as
+it ends. Rooms whose sockets close are replaced before the next window. By default a local uvicorn
+running server:app is started with FRAME_TIMESTAMPS=1 so broadcast latency can
+be measured; pass --url to hit a server that is already running instead.
+
+Examples:
+    python loadtest.py --rooms 4 --duration 10
+    python loadtest.py --ramp --step-rooms 5 --pacmen 1 --ghosts 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import websockets
+
+import protocol
+
+DIRECTIONS = ["up", "down", "left", "right"]
+
+
+# ===== BOTS =====
+class Counters:
+    """Client-side totals shared by all bots"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.latencies = []  # ms from server send to bot receive
+        self.errors = 0
+
+    def snapshot(self):
+        return self.messages, self.bytes, len(self.latencies)
+
+
+class Bot:
+    def __init__(self, base_url, role, key_rate, wire_format, counters):
+        self.base_url = base_url
+        self.role = role
+        self.key_rate = key_rate
+        self.wire_format = wire_format
+        self.counters = counters
+        self.lobby = None
+        self.game = None
+        self.session_id = None
+        self.tasks = []
+        self.connected = False  # Game socket open
+        self.game_over = False
+
+    async def join_lobby(self):
+        self.lobby = await websockets.connect(f"{self.base_url}/lobby")
+        while self.session_id is None:
+            msg = json.loads(await self.lobby.recv())
+            if "error" in msg:
+                raise RuntimeError(msg["error"])
+            self.session_id = msg.get("session_id")
+
+    async def choose_role(self):
+        await self.lobby.send(json.dumps({"role": self.role}))
+
+    async def wait_start(self):
+        while True:
+            msg = json.loads(await self.lobby.recv())
+            if "error" in msg:
+                raise RuntimeError(msg["error"])
+            if msg.get("start_game"):
+                return
+
+    async def play(self):
+        # The lobby socket stays open like the browser client's; once the game starts, closing it only
+        # drops that socket, and the session lives on in the game
+        self.game = await websockets.connect(
+            f"{self.base_url}/ws/{self.session_id}?format={self.wire_format}", max_size=None)
+        self.connected = True
+        self.tasks = [asyncio.create_task(self.send_keys()), asyncio.create_task(self.receive())]
+
+    async def send_keys(self):
+        rng = random.Random(self.session_id)
+        direction = rng.choice(DIRECTIONS)
+        try:
+            while True:
+                await asyncio.sleep(1 / self.key_rate)
+                # Hold a direction for a while, like a player cornering
+                if rng.random() < 0.2:
+                    direction = rng.choice(DIRECTIONS)
+                await self.game.send(json.dumps({"type": "move", "direction": direction}))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def receive(self):
+        counters = self.counters
+        try:
+            async for raw in self.game:
+                now = time.time()
+                counters.messages += 1
+                counters.bytes += len(raw)
+                if isinstance(raw, str):
+                    msg = json.loads(raw)
+                    if "ts" in msg:
+                        counters.latencies.append((now - msg["ts"]) * 1000)
+                    game_over = msg.get("game_over", self.game_over)  # Deltas only carry it when it changes
+                else:
+                    game_over = bool(protocol.HEADER.unpack_from(raw)[2] & protocol.FLAG_GAME_OVER)
+                if game_over and not self.game_over:
+                    # A finished room only resends a frozen board, then closes after GAME_OVER_TIMEOUT
+                    await self.game.send(json.dumps({"type": "restart"}))
+                self.game_over = game_over
+        except websockets.ConnectionClosed:
+            counters.errors += 1
+        finally:
+            self.connected = False
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for ws in (self.game, self.lobby):
+            if ws is not None:
+                await ws.close()
+
+
+async def start_room(args, counters):
+    """Fill one lobby with bots and wait for its game to start"""
+    bots = [Bot(args.ws_url, "Ghost", args.key_rate, args.format, counters) for _ in range(args.ghosts)]
+    bots += [Bot(args.ws_url, "Pac-Man", args.key_rate, args.format, counters) for _ in range(args.pacmen)]
+    # Everyone joins before anyone picks a role so they all land in the same room
+    for bot in bots:
+        await bot.join_lobby()
+    # Ghosts first so the Pac-Man ratio check always passes
+    for bot in bots:
+        await bot.choose_role()
+    await asyncio.gather(*(bot.wait_start() for bot in bots))
+    for bot in bots:
+        await bot.play()
+    return bots
+
+
+# ===== SERVER SIDE =====
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(port):
+    env = dict(os.environ, FRAME_TIMESTAMPS="1")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/rooms", timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("Server did not start")
+
+
+def fetch_tick_stats(http_url):
+    with urllib.request.urlopen(f"{http_url}/stats/tick", timeout=5) as resp:
+        return json.load(resp)
+
+
+def process_cpu_seconds(pid):
+    """utime + stime of a local process, None where /proc isn't available"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError):
+        return None
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# ===== MEASUREMENT =====
+async def measure(args, counters, server_pid, bots, rooms):
+    """Sample one window and return a result row; only bots still connected at its end count as players"""
+    before_stats = fetch_tick_stats(args.http_url)
+    before_counts = counters.snapshot()
+    before_cpu = process_cpu_seconds(server_pid) if server_pid else None
+    start = time.perf_counter()
+
+    await asyncio.sleep(args.duration)
+
+    elapsed = time.perf_counter() - start
+    after_stats = fetch_tick_stats(args.http_url)
+    messages, nbytes, latency_count = counters.snapshot()
+    after_cpu = process_cpu_seconds(server_pid) if server_pid else None
+
+    ticks = 0
+    overruns = 0
+    tick_ms = 0.0
+    max_ms = 0.0
+    budget_ms = None
+    for room_id, stats in after_stats.items():
+        prev = before_stats.get(room_id, {"ticks": 0, "overruns": 0})
+        ticks += stats["ticks"] - prev["ticks"]
+        overruns += stats["overruns"] - prev["overruns"]
+        tick_ms += stats["avg_ms"]
+        max_ms = max(max_ms, stats["max_ms"])
+        budget_ms = stats["budget_ms"]
+
+    latencies = counters.latencies[before_counts[2]:latency_count]
+    cpu_per_tick = None
+    if before_cpu is not None and after_cpu is not None and ticks:
+        cpu_per_tick = (after_cpu - before_cpu) * 1000 / ticks
+
+    return {
+        "players": sum(bot.connected for bot in bots),
+        "rooms": rooms,
+        "msgs_per_s": (messages - before_counts[0]) / elapsed,
+        "bytes_per_s": (nbytes - before_counts[1]) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        # Rooms share one event loop, so their tick times add up against one budget
+        "loop_ms": tick_ms,
+        "max_ms": max_ms,
+        "cpu_ms": cpu_per_tick,
+        "overruns": overruns,
+        "ticks": ticks,
+        "budget_ms": budget_ms,
+    }
+
+
+def print_header():
+    print(f"{'players':>7} {'rooms':>5} {'msg/s':>9} {'KB/s':>9} {'p50ms':>7} {'p95ms':>7} {'p99ms':>7} "
+          f"{'loop ms':>8} {'max ms':>7} {'cpu ms/tick':>11} {'overruns':>8}")
+
+
+def print_row(row):
+    cpu = f"{row['cpu_ms']:11.3f}" if row["cpu_ms"] is not None else f"{'n/a':>11}"
+    print(f"{row['players']:7d} {row['rooms']:5d} {row['msgs_per_s']:9.0f} {row['bytes_per_s'] / 1024:9.1f} "
+          f"{row['p50']:7.2f} {row['p95']:7.2f} {row['p99']:7.2f} {row['loop_ms']:8.2f} {row['max_ms']:7.2f} "
+          f"{cpu} {row['overruns']:8d}")
+
+
+def over_budget(row):
+    if row["budget_ms"] is None:
+        return False
+    return row["loop_ms"] > row["budget_ms"] or row["overruns"] > row["ticks"] * 0.05
+
+
+async def run(args, server_pid):
+    counters = Counters()
+    bots = []
+    room_size = args.pacmen + args.ghosts
+    print_header()
+    try:
+        target_rooms = args.rooms
+        while True:
+            # Bots whose room closed under them are replaced by fresh rooms
+            dropped = [bot for bot in bots if not bot.connected]
+            if dropped:
+                bots = [bot for bot in bots if bot.connected]
+                await asyncio.gather(*(bot.close() for bot in dropped), return_exceptions=True)
+            while len(bots) // room_size < target_rooms:
+                bots += await start_room(args, counters)
+            await asyncio.sleep(args.warmup)
+            row = await measure(args, counters, server_pid, bots, target_rooms)
+            print_row(row)
+            if over_budget(row):
+                print(f"Tick budget ({row['budget_ms']:.1f} ms) exceeded at {row['players']} players "
+                      f"in {target_rooms} rooms")
+                break
+            if not args.ramp or target_rooms >= args.max_rooms:
+                break
+            target_rooms += args.step_rooms
+        if counters.errors:
+            print(f"{counters.errors} bot connections closed early")
+    finally:
+        await asyncio.gather(*(bot.close() for bot in bots), return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="server base URL, e.g. http://127.0.0.1:8000 (default: start one locally)")
+    parser.add_argument("--pacmen", type=int, default=1, help="Pac-Man bots per room")
+    parser.add_argument("--ghosts", type=int, default=4, help="ghost bots per room")
+    parser.add_argument("--rooms", type=int, default=1, help="rooms to start with")
+    parser.add_argument("--key-rate", type=float, default=8.0, help="key presses per second per bot")
+    parser.add_argument("--format", choices=["json", "binary"], default="json",
+                        help="wire format (latency is only measured for json)")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds measured per step")
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds to settle before measuring")
+    parser.add_argument("--ramp", action="store_true", help="keep adding rooms until the tick budget is exceeded")
+    parser.add_argument("--step-rooms", type=int, default=5, help="rooms added per ramp step")
+    parser.add_argument("--max-rooms", type=int, default=200, help="stop ramping after this many rooms")
+    args = parser.parse_args()
+
+    proc = None
+    if args.url:
+        args.http_url = args.url.rstrip("/")
+    else:
+        port = free_port()
+        proc = start_local_server(port)
+        args.http_url = f"http://127.0.0.1:{port}"
+    args.ws_url = args.http_url.replace("http", "ws", 1)
+
+    try:
+        asyncio.run(run(args, proc.pid if proc else None))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Process-wide counters and phase timers in Prometheus text format.
+
+Counters are plain increments and always on. Phase timing costs two
+``perf_counter`` calls per timed section; set ``METRICS=0`` to turn it off.
+Gauges such as connected sockets are read from the rooms at scrape time by
+the caller and passed to ``render``.
+
+``sample_stacks`` is a small sampling profiler: it reads another thread's
+stack at a fixed interval and returns collapsed stacks (``a;b;c count``), the
+input format of flamegraph.pl and speedscope.
+"""
+import os
+import sys
+import time
+from collections import Counter
+
+PHASE_TIMING = os.environ.get("METRICS", "1") != "0"
+
+PHASES = ("move_player", "move_ai_ghost", "check_collisions", "render_board", "serialize")
+TICK_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+PREFIX = "pacman_"
+
+phase_seconds = dict.fromkeys(PHASES, 0.0)
+phase_calls = dict.fromkeys(PHASES, 0)
+messages_in = Counter()  # socket kind -> messages received
+dropped_sends = Counter()  # reason -> messages that never reached a client
+rejected_inputs = Counter()  # reason -> client inputs that never moved anyone
+rooms_closed = Counter()  # reason -> rooms torn down
+messages_out = 0
+bytes_out = 0
+send_wait_seconds = 0.0  # Wall clock across awaited socket writes, not CPU time
+tick_buckets = [0] * len(TICK_BUCKETS)
+tick_sum = 0.0
+tick_count = 0
+tick_overruns = 0
+
+
+# ===== RECORDING =====
+def phase_start():
+    """Start time for ``phase_end``, or 0.0 when phase timing is off"""
+    return time.perf_counter() if PHASE_TIMING else 0.0
+
+
+def phase_end(phase, start, calls=1):
+    if PHASE_TIMING:
+        phase_seconds[phase] += time.perf_counter() - start
+        phase_calls[phase] += calls
+
+
+def count_sent(nbytes, start=0.0):
+    """One frame written; ``start`` is its ``phase_start`` time, taken before the awaited send"""
+    global messages_out, bytes_out, send_wait_seconds
+    messages_out += 1
+    bytes_out += nbytes
+    if PHASE_TIMING:
+        send_wait_seconds += time.perf_counter() - start
+
+
+def count_drop(reason, messages=1):
+    dropped_sends[reason] += messages
+
+
+def observe_tick(seconds, overrun):
+    global tick_sum, tick_count, tick_overruns
+    tick_sum += seconds
+    tick_count += 1
+    if overrun:
+        tick_overruns += 1
+    for i, bound in enumerate(TICK_BUCKETS):
+        if seconds <= bound:
+            tick_buckets[i] += 1
+            break
+
+
+# ===== EXPOSITION =====
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def _family(lines, name, kind, help_text, samples):
+    """Append one metric family; ``samples`` is a list of (labels dict, value)"""
+    lines.append(f"# HELP {PREFIX}{name} {help_text}")
+    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{PREFIX}{name}{_labels(**labels)} {value}")
+
+
+def render(gauges):
+    """Prometheus text for every metric plus ``gauges``: {name: (help, [(labels, value)])}"""
+    lines = []
+    _family(lines, "phase_seconds_total", "counter", "Time spent in each tick phase",
+            [({"phase": p}, round(phase_seconds[p], 6)) for p in PHASES])
+    _family(lines, "phase_calls_total", "counter", "Timed sections per tick phase",
+            [({"phase": p}, phase_calls[p]) for p in PHASES])
+
+    buckets = []
+    cumulative = 0
+    for bound, count in zip(TICK_BUCKETS, tick_buckets):
+        cumulative += count
+        buckets.append(({"le": bound}, cumulative))
+    buckets.append(({"le": "+Inf"}, tick_count))
+    lines.append(f"# HELP {PREFIX}tick_duration_seconds Simulation plus broadcast time per room tick")
+    lines.append(f"# TYPE {PREFIX}tick_duration_seconds histogram")
+    for labels, value in buckets:
+        lines.append(f"{PREFIX}tick_duration_seconds_bucket{_labels(**labels)} {value}")
+    lines.append(f"{PREFIX}tick_duration_seconds_sum {round(tick_sum, 6)}")
+    lines.append(f"{PREFIX}tick_duration_seconds_count {tick_count}")
+    _family(lines, "tick_overruns_total", "counter", "Room ticks that took longer than the tick interval",
+            [({}, tick_overruns)])
+
+    _family(lines, "messages_in_total", "counter", "Messages received from clients",
+            [({"socket": kind}, count) for kind, count in sorted(messages_in.items())])
+    _family(lines, "rejected_inputs_total", "counter", "Client inputs dropped by the rate limit or replaced unapplied",
+            [({"reason": reason}, count) for reason, count in sorted(rejected_inputs.items())])
+    _family(lines, "rooms_closed_total", "counter", "Rooms torn down, by why",
+            [({"reason": reason}, count) for reason, count in sorted(rooms_closed.items())])
+    _family(lines, "messages_out_total", "counter", "Game frames written to sockets", [({}, messages_out)])
+    _family(lines, "bytes_out_total", "counter", "Game frame bytes written to sockets", [({}, bytes_out)])
+    _family(lines, "send_wait_seconds_total", "counter",
+            "Wall-clock time writer tasks spent awaiting socket writes, including other coroutines running meanwhile",
+            [({}, round(send_wait_seconds, 6))])
+    _family(lines, "dropped_sends_total", "counter", "Messages that never reached a client",
+            [({"reason": reason}, count) for reason, count in sorted(dropped_sends.items())])
+
+    for name, (help_text, samples) in gauges.items():
+        _family(lines, name, "gauge", help_text, samples)
+    return "\n".join(lines) + "\n"
+
+
+# ===== SAMPLING PROFILER =====
+def sample_stacks(thread_id, seconds, interval):
+    """Collapsed stacks of ``thread_id`` sampled every ``interval`` seconds.
+
+    Run it from a different thread than the one being sampled.
+    """
+    counts = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if stack:
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
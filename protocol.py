@@ -0,0 +1,109 @@
+"""Compact binary encoding for the game WebSocket.
+
+All integers are little-endian. Every message starts with a fixed header::
+
+    u8  type          MSG_KEYFRAME or MSG_DELTA
+    u32 seq
+    u8  flags         bit 0: game over
+    u8  level
+    u8  winner        char code of the winner, 0 if none
+    u32 pellets_left
+    u16 entity_count
+
+followed by ``entity_count`` fixed-width entity records::
+
+    u8 char, u8 kind, u8 flags, u16 x, u16 y, u32 score, u8 lives, u8 power_seconds, u16 input_ack
+
+``input_ack`` is the sequence number of the player's last input the server
+took or discarded (0 for AI ghosts), for client-side prediction.
+
+A keyframe then carries ``u16 width, u16 height`` and the tile grid packed two
+cells per byte (high nibble first). A delta carries ``u32 cell_count`` and that
+many ``u32 index, u8 tile`` pairs. Tiles are the static board plus fruits;
+entities are never baked into the grid.
+"""
+import struct
+
+MSG_KEYFRAME = 1
+MSG_DELTA = 2
+
+# Tile codes: index into this string
+TILE_CHARS = " #.@GT-CSOAM"
+TILE_CODES = {char: code for code, char in enumerate(TILE_CHARS)}
+
+KIND_PACMAN = 0
+KIND_GHOST = 1
+KIND_AI_GHOST = 2
+
+FLAG_ALIVE = 1
+FLAG_POWERED = 2
+FLAG_FLASHING = 4
+FLAG_IN_PEN = 8
+
+FLAG_GAME_OVER = 1
+
+HEADER = struct.Struct("<BIBBBIH")
+ENTITY = struct.Struct("<BBBHHIBBH")
+GRID_SIZE = struct.Struct("<HH")
+CELL_COUNT = struct.Struct("<I")
+CELL = struct.Struct("<IB")
+
+
+# Byte -> tile code lookup for bytes.translate; unknown bytes map to empty floor
+TILE_TABLE = bytes(TILE_CODES.get(chr(b), 0) for b in range(256))
+
+
+def encode_tiles(board, width, fruits):
+    """One tile code per cell, row-major, with fruits drawn in.
+
+    ``board`` is a room's newline-separated board buffer.
+    """
+    tiles = bytearray(board.translate(TILE_TABLE, b"\n"))
+    for fruit in fruits:
+        tiles[fruit["y"] * width + fruit["x"]] = TILE_CODES[fruit["type"]]
+    return tiles
+
+
+def diff_tiles(old, new):
+    """(index, code) for every tile that changed"""
+    if old == new:
+        return []
+    return [(i, b) for i, (a, b) in enumerate(zip(old, new)) if a != b]
+
+
+def encode_entities(records):
+    """Pack (char, kind, flags, x, y, score, lives, power_seconds, input_ack) tuples"""
+    return b"".join(ENTITY.pack(ord(char), kind, flags, x, y, score, max(lives, 0), power, ack)
+                    for char, kind, flags, x, y, score, lives, power, ack in records)
+
+
+def pack_grid(tiles):
+    """Two 4-bit tile codes per byte"""
+    packed = bytearray((len(tiles) + 1) // 2)
+    for i in range(0, len(tiles) - 1, 2):
+        packed[i // 2] = (tiles[i] << 4) | tiles[i + 1]
+    if len(tiles) % 2:
+        packed[-1] = tiles[-1] << 4
+    return packed
+
+
+def encode_header(msg_type, seq, flags, level, winner, pellets_left, entity_count):
+    return HEADER.pack(msg_type, seq, flags, level, ord(winner) if winner else 0, pellets_left, entity_count)
+
+
+def encode_keyframe(header_fields, entities, entity_count, width, height, tiles):
+    return b"".join((
+        encode_header(MSG_KEYFRAME, *header_fields, entity_count),
+        entities,
+        GRID_SIZE.pack(width, height),
+        pack_grid(tiles),
+    ))
+
+
+def encode_delta(header_fields, entities, entity_count, cells):
+    return b"".join((
+        encode_header(MSG_DELTA, *header_fields, entity_count),
+        entities,
+        CELL_COUNT.pack(len(cells)),
+        b"".join(CELL.pack(i, code) for i, code in cells),
+    ))
@@ -0,0 +1,255 @@
+"""Match recordings and a headless replay runner.
+
+A recording is an append-only binary log, little-endian throughout. It starts
+with a header::
+
+    4s magic "PREC", u16 version, u64 rng seed, f64 start time,
+    u8 + bytes map name, u8 + bytes room id
+
+followed by records, each a u8 type and a fixed payload:
+
+    TICK     f64 game clock for the tick that follows
+    JOIN     u16 player, u8 role, u8 + bytes session id
+    LEAVE    u16 player
+    MOVE     u16 player, u8 direction
+    RESTART  (no payload)
+    CHECK    u32 tick, u32 state checksum
+
+Players are numbered in join order. Inputs are logged as they arrive, so
+everything between two TICK records is applied before the second tick runs,
+exactly as the live room applied it. Given the seed, a replay re-creates the
+match tick for tick; CHECK records catch any divergence.
+
+Examples:
+    python replay.py recordings/w0-1a2b3c4d.pmr
+    python replay.py recordings/w0-1a2b3c4d.pmr --broadcast --slowest 10
+"""
+import argparse
+import struct
+import time
+from collections import deque
+
+from game_map import DIRECTION_ORDER
+
+MAGIC = b"PREC"
+VERSION = 1
+HEADER = struct.Struct("<4sHQd")
+RECORD_TYPE = struct.Struct("<B")
+
+REC_TICK = 1
+REC_JOIN = 2
+REC_LEAVE = 3
+REC_MOVE = 4
+REC_RESTART = 5
+REC_CHECK = 6
+
+TICK = struct.Struct("<d")
+JOIN = struct.Struct("<HB")
+LEAVE = struct.Struct("<H")
+MOVE = struct.Struct("<HB")
+CHECK = struct.Struct("<II")
+
+ROLES = ("Pac-Man", "Ghost")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTION_ORDER)}
+
+CHECK_INTERVAL = 100  # Ticks between state checksums
+FLUSH_BYTES = 64 * 1024  # Buffered log size that forces a write
+FLUSH_TICKS = 100  # Ticks between writes otherwise
+
+
+# ===== RECORDING =====
+def _short_string(text):
+    data = text.encode()
+    return bytes((len(data),)) + data
+
+
+class Recorder:
+    """Buffers one room's log and writes it to a new file at ``path`` in chunks"""
+
+    def __init__(self, path, seed, start, map_name, room_id):
+        self.file = open(path, "xb")  # Never a second header onto an old log; raises FileExistsError
+        self.buffer = bytearray(HEADER.pack(MAGIC, VERSION, seed, start))
+        self.buffer += _short_string(map_name) + _short_string(room_id)
+        self.players = {}  # session_id -> player number
+        self.ticks = 0
+
+    def join(self, session_id, role):
+        number = self.players[session_id] = len(self.players)
+        self.buffer += RECORD_TYPE.pack(REC_JOIN) + JOIN.pack(number, ROLE_CODES[role])
+        self.buffer += _short_string(session_id)
+
+    def leave(self, session_id):
+        number = self.players.get(session_id)
+        if number is not None:
+            self.buffer += RECORD_TYPE.pack(REC_LEAVE) + LEAVE.pack(number)
+
+    def move(self, session_id, direction):
+        number = self.players.get(session_id)
+        if number is not None:
+            self.buffer += RECORD_TYPE.pack(REC_MOVE) + MOVE.pack(number, DIRECTION_CODES[direction])
+
+    def restart(self):
+        self.buffer += RECORD_TYPE.pack(REC_RESTART)
+
+    def tick(self, now):
+        self.buffer += RECORD_TYPE.pack(REC_TICK) + TICK.pack(now)
+        self.ticks += 1
+        if len(self.buffer) >= FLUSH_BYTES or self.ticks % FLUSH_TICKS == 0:
+            self.flush()
+
+    def wants_check(self):
+        return self.ticks % CHECK_INTERVAL == 0
+
+    def check(self, checksum):
+        self.buffer += RECORD_TYPE.pack(REC_CHECK) + CHECK.pack(self.ticks, checksum)
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+# ===== READING =====
+def read_recording(path):
+    """Header dict and the list of (type, fields) records"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, seed, start = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: not a version {VERSION} recording")
+    offset = HEADER.size
+    strings = []
+    for _ in range(2):
+        length = data[offset]
+        strings.append(data[offset + 1:offset + 1 + length].decode())
+        offset += 1 + length
+    header = {"seed": seed, "start": start, "map": strings[0], "room_id": strings[1]}
+
+    records = []
+    while offset < len(data):
+        (kind,) = RECORD_TYPE.unpack_from(data, offset)
+        offset += 1
+        if kind == REC_TICK:
+            fields = TICK.unpack_from(data, offset)
+            offset += TICK.size
+        elif kind == REC_JOIN:
+            number, role = JOIN.unpack_from(data, offset)
+            offset += JOIN.size
+            length = data[offset]
+            fields = (number, ROLES[role], data[offset + 1:offset + 1 + length].decode())
+            offset += 1 + length
+        elif kind == REC_LEAVE:
+            fields = LEAVE.unpack_from(data, offset)
+            offset += LEAVE.size
+        elif kind == REC_MOVE:
+            number, direction = MOVE.unpack_from(data, offset)
+            fields = (number, DIRECTION_ORDER[direction])
+            offset += MOVE.size
+        elif kind == REC_RESTART:
+            fields = ()
+        elif kind == REC_CHECK:
+            fields = CHECK.unpack_from(data, offset)
+            offset += CHECK.size
+        else:
+            raise ValueError(f"{path}: unknown record type {kind} at byte {offset - 1}")
+        records.append((kind, fields))
+    return header, records
+
+
+# ===== REPLAY =====
+class NullConnection:
+    """Stands in for a client socket when a replay also runs the broadcast path"""
+
+    def __init__(self):
+        self.queue = deque()
+        self.sent = 0
+
+    def push(self, payload, keyframe=False):
+        self.sent += 1
+        return True
+
+
+def replay(path, broadcast=False):
+    """Re-simulate a recording as fast as possible.
+
+    Returns a result dict with per-tick durations (seconds, in tick order),
+    the recorded clock of each tick, and any checksum mismatches.
+    """
+    import server
+
+    header, records = read_recording(path)
+    room = server.GameRoom(header["room_id"], header["map"], seed=header["seed"])
+    room.clock.set(header["start"])
+    room.begin()
+
+    sessions = {}  # player number -> session id
+    durations = []
+    clock = []
+    mismatches = []
+    for kind, fields in records:
+        if kind == REC_TICK:
+            room.clock.set(fields[0])
+            start = time.perf_counter()
+            room.game_tick()
+            if broadcast:
+                room.broadcast_game_state()
+            durations.append(time.perf_counter() - start)
+            clock.append(fields[0])
+        elif kind == REC_MOVE:
+            room.queue_move(sessions[fields[0]], fields[1])
+        elif kind == REC_JOIN:
+            number, role, session_id = fields
+            sessions[number] = session_id
+            room.lobby.join(session_id, None)
+            room.lobby.set_role(session_id, role)
+            room.add_player(session_id, NullConnection() if broadcast else None)
+        elif kind == REC_LEAVE:
+            room.remove_player(sessions[fields[0]])
+        elif kind == REC_RESTART:
+            room.request_restart()
+        elif kind == REC_CHECK:
+            tick, expected = fields
+            actual = room.state_checksum()
+            if actual != expected:
+                mismatches.append((tick, expected, actual))
+
+    return {"header": header, "durations": durations, "clock": clock, "mismatches": mismatches, "room": room}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="recording file (.pmr)")
+    parser.add_argument("--broadcast", action="store_true", help="also build and encode every frame")
+    parser.add_argument("--slowest", type=int, default=5, help="list this many of the slowest ticks")
+    args = parser.parse_args()
+
+    result = replay(args.path, args.broadcast)
+    durations = result["durations"]
+    if not durations:
+        print("No ticks recorded")
+        return
+    total = sum(durations)
+    ordered = sorted(durations)
+    header = result["header"]
+    print(f"Room {header['room_id']} on {header['map']}, seed {header['seed']}")
+    print(f"{len(durations)} ticks in {total:.3f} s, {len(durations) / total:.0f} ticks/s")
+    print(f"tick ms: p50 {ordered[len(ordered) // 2] * 1e3:.3f}  "
+          f"p99 {ordered[min(len(ordered) - 1, len(ordered) * 99 // 100)] * 1e3:.3f}  max {ordered[-1] * 1e3:.3f}")
+    slowest = sorted(range(len(durations)), key=durations.__getitem__, reverse=True)[:args.slowest]
+    for i in slowest:
+        print(f"  tick {i:6d}  {durations[i] * 1e3:8.3f} ms  at +{result['clock'][i] - header['start']:.2f} s")
+    if result["mismatches"]:
+        tick, expected, actual = result["mismatches"][0]
+        print(f"Replay diverged: {len(result['mismatches'])} checksum mismatches, first at tick {tick}")
+    else:
+        print("Replay matched every checksum")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,78 +1,60 @@
 import os
 import asyncio
+import json
 import random
-import copy
 import uuid
+import threading
 import time
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse
+import traceback
+import zlib
+from array import array
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, PlainTextResponse
 from typing import Dict, List, Tuple
+from game_map import MapError, load_maps
+import metrics
+import protocol
+import replay
+import stats
 
-app = FastAPI(title="ASCII Pac-Man Multiplayer - Full Featured", version="1.0")
-
-# ===== PAC-MAN MAP =====
-RAW_MAP = [
-    "############################",
-    "#............##............#",
-    "#.####.#####.##.#####.####.#",
-    "#@#  #.#   #.##.#   #.#  #@#",
-    "#.####.#####.##.#####.####.#",
-    "#..........................#",
-    "#.####.##.########.##.####.#",
-    "#.####.##.########.##.####.#",
-    "#......##....##....##......#",
-    "######.##### ## #####.######",
-    "     #.##### ## #####.#     ",
-    "     #.##          ##.#     ",
-    "     #.## ###--### ##.#     ",
-    "######.## #GGGGGG# ##.######",
-    "T     .   #GGGGGG#   .     T",
-    "######.## #GGGGGG# ##.######",
-    "     #.## ######## ##.#     ",
-    "     #.##          ##.#     ",
-    "     #.## ######## ##.#     ",
-    "######.## ######## ##.######",
-    "#............##............#",
-    "#.####.#####.##.#####.####.#",
-    "#.####.#####.##.#####.####.#",
-    "#@..##.......  .......##..@#",
-    "###.##.##.########.##.##.###",
-    "###.##.##.########.##.##.###",
-    "#......##....##....##......#",
-    "#.##########.##.##########.#",
-    "#.##########.##.##########.#",
-    "#..........................#",
-    "############################"
-]
+@asynccontextmanager
+async def lifespan(app):
+    global stats_store
+    flusher = None
+    if STATS_DIR:
+        os.makedirs(STATS_DIR, exist_ok=True)
+        stats_store = stats.StatsStore(os.path.join(STATS_DIR, f"w{WORKER_ID}.sqlite3"))
+        await asyncio.to_thread(stats_store.open)
+        flusher = asyncio.create_task(stats_store.flush_loop())
+    sweeper = asyncio.create_task(sweep_rooms())
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+        for room in list(rooms.values()):
+            room.stop()
+        if stats_store is not None:
+            flusher.cancel()
+            await stats_store.close()
+            stats_store = None
 
-# ===== GAME STATE =====
-GAME_MAP = [list(row) for row in RAW_MAP]
-game_level = 1
-game_over = False
-winner = None
+app = FastAPI(title="ASCII Pac-Man Multiplayer - Full Featured", version="1.0", lifespan=lifespan)
 
-# ===== LOBBY SYSTEM =====
-lobby = {}
-session_to_ws = {}
-roles_taken = {"Pac-Man": 0, "Ghost": 0}
-game_started = False
+# ===== MAPS =====
+# Every maps/*.txt file is validated and compiled at startup; rooms pick one by name
+MAPS_DIR = os.environ.get("MAPS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps"))
+DEFAULT_MAP = os.environ.get("DEFAULT_MAP", "classic")
 
 # ===== PLAYERS =====
-players = {}
 player_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-PACMAN_SPAWNS = [(1,1),(26,1),(1,29),(26,29)]
-GHOST_SPAWNS = [(12,14),(13,14),(14,14),(15,14)]
-GHOST_PEN_EXITS = [(13,11),(14,11)]
 
 # ===== AI GHOSTS =====
-ai_ghosts = []
 GHOST_NAMES = ["Blinky", "Pinky", "Inky", "Clyde"]
 GHOST_BEHAVIORS = ["chase", "ambush", "random", "patrol"]
-ghost_mode = "scatter"  # "scatter" or "chase"
-ghost_mode_timer = 0
 
 # ===== FRUIT SYSTEM =====
-fruits = []  # {"x", "y", "type", "points", "spawn_time"}
 FRUIT_TYPES = [
     {"char": "C", "name": "Cherry", "points": 100},
     {"char": "S", "name": "Strawberry", "points": 300},
@@ -81,7 +63,6 @@ FRUIT_TYPES = [
     {"char": "M", "name": "Melon", "points": 1000},
 ]
 FRUIT_DURATION = 10  # seconds
-pellets_eaten_for_fruit = 0
 PELLETS_PER_FRUIT = 30
 
 # ===== POWER PELLET SETTINGS =====
@@ -100,641 +81,2036 @@ GHOST_TUNNEL_SPEED = 0.25  # Slower in tunnels
 GHOST_FRIGHTENED_SPEED = 0.25  # Slower when frightened
 AI_GHOST_UPDATE_INTERVAL = 0.5
 
+# ===== TICK SETTINGS =====
+TICK_RATE = int(os.environ.get("TICK_RATE", 20))  # Server ticks per second
+TICK_INTERVAL = 1.0 / TICK_RATE
+TICK_ERROR_INTERVAL = 10  # Seconds between tracebacks when a room's tick keeps failing
+
+# ===== INPUT LIMITS =====
+INPUT_RATE = 20  # Game socket messages refilled per second, per connection
+INPUT_BURST = 10  # Messages a connection may send back to back
+TURN_BUFFER_TIME = 0.5  # Seconds a turn pressed early stays buffered
+INPUT_SEQ_LIMIT = 0x10000  # Client input sequence numbers are u16 and wrap
+KEYFRAME_INTERVAL = 100  # Full board resend every N deltas
+SEND_QUEUE_SIZE = 8  # Max frames waiting on one slow client before we drop to a keyframe
+WIRE_FORMATS = ("json", "binary")
+FRAME_TIMESTAMPS = os.environ.get("FRAME_TIMESTAMPS") == "1"  # Stamp JSON frames with send time (load tests)
+
+# ===== METRICS =====
+PROFILER_ENABLED = os.environ.get("PROFILER") == "1"  # Allow /debug/profile stack sampling
+MAX_PROFILE_SECONDS = 60
+
+# ===== RECORDING =====
+RECORD_DIR = os.environ.get("RECORD_DIR")  # Write a replay log per room here, see replay.py
+
+# ===== SPECTATORS =====
+SPECTATOR_RATE = 5  # Frames per second sent to /watch sockets
+SPECTATOR_INTERVAL = max(1, TICK_RATE // SPECTATOR_RATE)  # Ticks between spectator frames
+SPECTATOR_BATCH = 256  # Spectator sockets fed before yielding to ticks and player sends
+
+# ===== ROOM LIFECYCLE =====
+# A room goes lobby -> running <-> game_over -> closed; closed rooms are dropped from the registry
+ROOM_LOBBY = "lobby"
+ROOM_RUNNING = "running"
+ROOM_GAME_OVER = "game_over"
+ROOM_CLOSED = "closed"
+ROOM_STATES = (ROOM_LOBBY, ROOM_RUNNING, ROOM_GAME_OVER, ROOM_CLOSED)
+RECONNECT_GRACE = float(os.environ.get("RECONNECT_GRACE", 30))  # Seconds a dropped player is held for a resume
+ROOM_IDLE_TIMEOUT = float(os.environ.get("ROOM_IDLE_TIMEOUT", 600))  # Seconds without client input before a room closes
+GAME_OVER_TIMEOUT = float(os.environ.get("GAME_OVER_TIMEOUT", 120))  # Seconds a finished game waits for a restart
+SWEEP_INTERVAL = 10  # Seconds between keep-alive pings and expiry checks
+
+# ===== CLUSTER =====
+# Set by cluster.py when this process is one of several workers behind its router.
+# Session and room ids carry it so the router knows where each one lives.
+WORKER_ID = int(os.environ.get("WORKER_ID", 0))
+ID_PREFIX = f"w{WORKER_ID}-"
+
+# ===== STATS =====
+# Match results go to a SQLite file per worker here; set STATS_DIR= (empty) to keep none
+STATS_DIR = os.environ.get("STATS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "stats"))
+
+# ===== INTEREST MANAGEMENT =====
+CHUNK_SIZE = 8  # Viewers subscribe to square chunks of the map
+MAX_VIEW_RADIUS = 32  # Largest ?view= radius a client may ask for, in cells
+MINIMAP_SCALE = 4  # Map cells per minimap cell along each side
+MINIMAP_INTERVAL = 20  # Ticks between minimap updates
+
 # ===== DIRECTIONS =====
 DIRECTIONS = {"up":(0,-1),"down":(0,1),"left":(-1,0),"right":(1,0)}
 
 # ===== ROLE LIMITS =====
 MAX_PACMAN_RATIO = 4
 
-def can_select_role(role):
-    current_pacman = roles_taken["Pac-Man"]
-    current_ghosts = roles_taken["Ghost"]
+# ===== LOBBY SETTINGS =====
+LOBBY_CAPACITY = len(player_chars)  # One player letter per session; more go to a new room
+LOBBY_FLUSH_INTERVAL = 0.1  # Lobby changes within this many seconds go out as one diff
+
+# ===== COMPILED MAPS =====
+# Walls, tunnels, the pen and the neighbor graph never change, so they are built once
+MAPS = load_maps(MAPS_DIR)
+if DEFAULT_MAP not in MAPS:
+    raise MapError(f"default map {DEFAULT_MAP!r} not found in {MAPS_DIR}")
+
+# ===== ENTITIES =====
+# Roles are small ints in game state; the lobby and the wire use the names
+PACMAN = 0
+GHOST = 1
+ROLE_NAMES = ("Pac-Man", "Ghost")
+ROLE_IDS = {name: role for role, name in enumerate(ROLE_NAMES)}
+
+class Player:
+    """A player's in-game state. Its socket lives in GameRoom.conns, never here."""
     
-    if role == "Pac-Man":
-        if current_pacman == 0:
-            return True
-        return current_ghosts >= (current_pacman * MAX_PACMAN_RATIO)
-    elif role == "Ghost":
-        return True
-    return False
-
-# ===== GAME FUNCTIONS =====
-def reset_game():
-    global GAME_MAP, game_level, game_over, winner, pellets_eaten_for_fruit, fruits
-    global ghost_mode, ghost_mode_timer
-    GAME_MAP = [list(row) for row in RAW_MAP]
-    game_level = 1
-    game_over = False
-    winner = None
-    pellets_eaten_for_fruit = 0
-    fruits = []
-    ghost_mode = "scatter"
-    ghost_mode_timer = time.time()
-    
-    # Reset all player stats
-    for player in players.values():
-        player["score"] = 0
-        player["lives"] = STARTING_LIVES
-        player["powered_up_until"] = 0
-        player["ghosts_eaten_combo"] = 0
-        player["is_alive"] = True
-        respawn_player(player)
-
-def count_pellets():
-    """Count remaining pellets on the map"""
-    count = 0
-    for row in GAME_MAP:
-        for cell in row:
-            if cell in ['.', '@']:
-                count += 1
-    return count
-
-def is_wall(x, y):
-    if y < 0 or y >= len(GAME_MAP) or x < 0 or x >= len(GAME_MAP[0]):
-        return True
-    return GAME_MAP[y][x] == "#"
+    __slots__ = ("sid", "x", "y", "char", "role", "score", "lives", "alive",
+                 "powered_up_until", "ghosts_eaten_combo", "last_move_time", "direction", "input_ack",
+                 "ghosts_eaten", "fruits_eaten", "lives_lost")
+    
+    def __init__(self, sid, x, y, char, role, now):
+        self.sid = sid
+        self.x = x
+        self.y = y
+        self.char = char
+        self.role = role
+        self.score = 0
+        self.lives = STARTING_LIVES
+        self.alive = True
+        self.powered_up_until = 0
+        self.ghosts_eaten_combo = 0
+        self.last_move_time = now
+        self.direction = None  # Last direction actually moved
+        self.input_ack = None  # Seq of the client's last input that was applied or expired; 0 is valid after a wrap
+        # Per-game totals for the stats store
+        self.ghosts_eaten = 0
+        self.fruits_eaten = 0
+        self.lives_lost = 0
+    
+    @property
+    def role_name(self):
+        return ROLE_NAMES[self.role]
 
-def is_tunnel(x, y):
-    """Check if position is in a tunnel (marked with T)"""
-    if y < 0 or y >= len(RAW_MAP) or x < 0 or x >= len(RAW_MAP[0]):
-        return False
-    return RAW_MAP[y][x] == "T"
+class AIGhost:
+    """A server-driven ghost; ``slot`` is its index in GameRoom.ai_ghosts"""
+    
+    __slots__ = ("slot", "x", "y", "char", "in_pen", "random_target")
+    
+    def __init__(self, slot, x, y, char):
+        self.slot = slot
+        self.x = x
+        self.y = y
+        self.char = char
+        self.in_pen = False
+        self.random_target = None
 
-def is_ghost_pen(x, y):
-    """Check if position is in ghost pen"""
-    if y < 0 or y >= len(RAW_MAP) or x < 0 or x >= len(RAW_MAP[0]):
-        return False
-    return RAW_MAP[y][x] == "G"
-
-def wrap_position(x, y):
-    """Handle tunnel wrapping"""
-    # Left tunnel wraps to right
-    if x < 0:
-        return len(GAME_MAP[0]) - 1, y
-    # Right tunnel wraps to left
-    if x >= len(GAME_MAP[0]):
-        return 0, y
-    return x, y
-
-def is_powered_up(player):
-    if player["role"] != "Pac-Man":
-        return False
-    return time.time() < player.get("powered_up_until", 0)
+# ===== PLAYER HELPERS =====
+def is_powered_up(player, now):
+    return player.role == PACMAN and now < player.powered_up_until
 
-def get_power_time_left(player):
-    if not is_powered_up(player):
+def get_power_time_left(player, now):
+    if not is_powered_up(player, now):
         return 0
-    return max(0, player.get("powered_up_until", 0) - time.time())
+    return max(0, player.powered_up_until - now)
 
-def should_flash_power(player):
+def should_flash_power(player, now):
     """Check if power pellet should flash (warning)"""
-    time_left = get_power_time_left(player)
+    time_left = get_power_time_left(player, now)
     return 0 < time_left <= POWER_FLASH_WARNING
 
-def respawn_player(player):
-    """Respawn a player at their starting position"""
-    if player["role"] == "Pac-Man":
-        # Find which pacman this is
-        pacman_players = [p for p in players.values() if p["role"] == "Pac-Man"]
-        idx = pacman_players.index(player) if player in pacman_players else 0
-        spawn_x, spawn_y = PACMAN_SPAWNS[idx % len(PACMAN_SPAWNS)]
-    else:  # Ghost
-        ghost_players = [p for p in players.values() if p["role"] == "Ghost"]
-        idx = ghost_players.index(player) if player in ghost_players else 0
-        spawn_x, spawn_y = GHOST_SPAWNS[idx % len(GHOST_SPAWNS)]
-    
-    player["x"], player["y"] = spawn_x, spawn_y
-    player["last_move_time"] = time.time()
-
-def spawn_fruit():
-    """Spawn a fruit at a random empty location"""
-    global fruits
-    
-    # Find empty spaces
-    empty_spaces = []
-    for y in range(len(GAME_MAP)):
-        for x in range(len(GAME_MAP[0])):
-            if GAME_MAP[y][x] == " " and not is_ghost_pen(x, y):
-                empty_spaces.append((x, y))
+def build_delta(old, new):
+    """Diff two frames: changed board cells, changed text fields and changed input acks.
     
-    if empty_spaces:
-        x, y = random.choice(empty_spaces)
-        fruit_type = FRUIT_TYPES[min(game_level - 1, len(FRUIT_TYPES) - 1)]
-        fruits.append({
-            "x": x,
-            "y": y,
-            "type": fruit_type["char"],
-            "name": fruit_type["name"],
-            "points": fruit_type["points"],
-            "spawn_time": time.time()
-        })
+    Entity moves and eaten pellets both show up as changed cells.
+    Returns None when nothing changed.
+    """
+    cells = []
+    for y, (old_row, new_row) in enumerate(zip(old["board"], new["board"])):
+        if old_row != new_row:
+            for x, (a, b) in enumerate(zip(old_row, new_row)):
+                if a != b:
+                    cells.append([x, y, b])
+    
+    delta = {}
+    if cells:
+        delta["cells"] = cells
+    for key in ("scores", "info", "power_status", "game_over"):
+        if old[key] != new[key]:
+            delta[key] = new[key]
+    # Per-player input acks: only entries that changed, None for players that are gone
+    old_acks, new_acks = old["acks"], new["acks"]
+    if old_acks != new_acks:
+        acks = {char: ack for char, ack in new_acks.items() if old_acks.get(char) != ack}
+        acks.update((char, None) for char in old_acks if char not in new_acks)
+        delta["acks"] = acks
+    return delta or None
+
+# ===== CLIENT CONNECTIONS =====
+def encode_json(message):
+    """Serialize a message once so it can be fanned out as text"""
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
 
-def update_fruits():
-    """Remove expired fruits"""
-    global fruits
-    current_time = time.time()
-    fruits = [f for f in fruits if current_time - f["spawn_time"] < FRUIT_DURATION]
+PING_MESSAGE = encode_json({"type": "ping"})
 
-def move_player(player, direction):
-    global pellets_eaten_for_fruit, game_over, winner
+class ClientConnection:
+    """Outbound side of one game socket: a bounded queue drained by its own writer task.
     
-    if not player.get("is_alive", True):
-        return
+    The tick only ever pushes; a slow client never blocks the game loop.
+    """
+    
+    def __init__(self, ws, max_queue=SEND_QUEUE_SIZE):
+        self.ws = ws
+        self.max_queue = max_queue
+        self.queue = deque()
+        self.control = deque()  # Messages sent ahead of frames and never dropped
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.closed = False
+        self.sent_at_sweep = 0  # ``sent`` at the last keep-alive check
+        self.task = asyncio.create_task(self.writer())
+    
+    def push(self, payload, keyframe=False):
+        """Queue an encoded frame. Returns False if it was dropped.
+        
+        A keyframe supersedes everything still queued. When a delta would
+        overflow the queue, the queued frames are stale: they are all dropped
+        and the caller should send a keyframe next (latest state wins).
+        """
+        if self.closed:
+            metrics.count_drop("closed")
+            return False
+        if keyframe:
+            if self.queue:
+                self.dropped += len(self.queue)
+                metrics.count_drop("superseded", len(self.queue))
+                self.queue.clear()
+        elif len(self.queue) >= self.max_queue:
+            self.dropped += len(self.queue) + 1
+            metrics.count_drop("queue_full", len(self.queue) + 1)
+            self.queue.clear()
+            return False
+        self.queue.append(payload)
+        self.ready.set()
+        return True
+    
+    def push_control(self, payload):
+        """Queue a small message that frames can't supersede, e.g. the welcome"""
+        if not self.closed:
+            self.control.append(payload)
+            self.ready.set()
+    
+    async def writer(self):
+        try:
+            while True:
+                if self.control:
+                    payload = self.control.popleft()
+                elif self.queue:
+                    payload = self.queue.popleft()
+                else:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                start = metrics.phase_start()
+                if isinstance(payload, bytes):
+                    await self.ws.send_bytes(payload)
+                else:
+                    await self.ws.send_text(payload)
+                self.sent += 1
+                self.bytes_sent += len(payload)
+                metrics.count_sent(len(payload), start)
+        except Exception:
+            # Socket is gone; the receive side handles cleanup
+            metrics.count_drop("send_error", len(self.queue) + 1)
+            self.closed = True
+            self.queue.clear()
     
-    # Check movement speed throttle
-    current_time = time.time()
-    last_move = player.get("last_move_time", 0)
-    
-    # Determine speed based on state
-    if player["role"] == "Pac-Man":
-        speed = PACMAN_SPEED
-    else:  # Ghost
-        if is_tunnel(player["x"], player["y"]):
-            speed = GHOST_TUNNEL_SPEED
-        elif any(is_powered_up(p) for p in players.values() if p["role"] == "Pac-Man"):
-            speed = GHOST_FRIGHTENED_SPEED
+    def close(self, code=None):
+        """Stop the writer; with a close ``code`` also close the socket, which ends its receive loop"""
+        if self.closed and code is None:
+            return
+        self.closed = True
+        self.task.cancel()
+        if code is not None:
+            self.task = asyncio.create_task(self.close_socket(code))
+    
+    async def close_socket(self, code):
+        try:
+            await self.ws.close(code=code)
+        except Exception:
+            pass  # Already gone
+    
+    def keep_alive(self):
+        """Ping if nothing went out since the last call, so proxies don't drop an idle socket"""
+        if self.sent == self.sent_at_sweep:
+            self.push_control(PING_MESSAGE)
+        self.sent_at_sweep = self.sent
+    
+    def stats(self):
+        return {
+            "queue_depth": len(self.queue),
+            "sent": self.sent,
+            "bytes_sent": self.bytes_sent,
+            "dropped": self.dropped,
+        }
+
+class TokenBucket:
+    """Input rate limit: ``rate`` tokens per second, at most ``burst`` saved up"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class Viewport:
+    """Interest-management state for a client that only sees the area around its entity"""
+    
+    def __init__(self, radius):
+        self.radius = radius
+        self.chunks = set()  # (cx, cy) chunks currently subscribed
+        self.seq = 0
+        self.center = None
+        self.ack = None  # Last input ack sent
+        self.pending = []  # Changed cells in subscribed chunks since the last update
+
+# ===== GAME CLOCK =====
+class GameClock:
+    """Game time for one room, frozen for the length of a tick.
+    
+    The tick loop sets it from the wall clock once per tick; a replay sets it
+    from the recording, so the game logic sees the same times either way.
+    """
+    
+    def __init__(self, now=0.0):
+        self.now = now
+    
+    def __call__(self):
+        return self.now
+    
+    def set(self, now):
+        self.now = now
+
+# ===== LOBBY =====
+class Lobby:
+    """Sessions waiting for one room's game to start.
+    
+    Role counts and the number of sessions still choosing are updated on
+    every change, so the ready check never scans the members. Changes are
+    batched for LOBBY_FLUSH_INTERVAL and sent as one diff, encoded once for
+    everybody; sessions that joined since the last flush get a full list.
+    """
+    
+    def __init__(self):
+        self.members = {}  # session_id -> {"name", "role"}
+        self.conns = {}  # session_id -> ClientConnection for the lobby socket
+        self.roles_taken = {"Pac-Man": 0, "Ghost": 0}
+        self.unassigned = 0  # Members without a role yet
+        self.next_number = 1  # Names are never reused, so they stay unique after leaves
+        self.changed = {}  # name -> member entry, or None if it left, since the last flush
+        self.needs_snapshot = set()  # Sessions that get the full list at the next flush
+        self.flush_task = None
+    
+    def full(self):
+        return len(self.members) >= LOBBY_CAPACITY
+    
+    def join(self, session_id, conn):
+        entry = {"name": f"Player{self.next_number}", "role": None}
+        self.next_number += 1
+        self.members[session_id] = entry
+        self.unassigned += 1
+        if conn is not None:
+            self.conns[session_id] = conn
+            self.needs_snapshot.add(session_id)
+        self.changed[entry["name"]] = entry
+        self.schedule_flush()
+        return entry
+    
+    def leave(self, session_id):
+        entry = self.members.pop(session_id, None)
+        if entry is None:
+            return
+        if entry["role"]:
+            self.roles_taken[entry["role"]] -= 1
         else:
-            speed = GHOST_SPEED
+            self.unassigned -= 1
+        conn = self.conns.pop(session_id, None)
+        if conn is not None:
+            conn.close()
+        self.needs_snapshot.discard(session_id)
+        self.changed[entry["name"]] = None
+        self.schedule_flush()
     
-    if current_time - last_move < speed:
-        return  # Too soon to move
+    def drop_conn(self, session_id):
+        """Close a member's lobby socket but keep the membership, once the game owns the session"""
+        conn = self.conns.pop(session_id, None)
+        if conn is not None:
+            conn.close()
+        self.needs_snapshot.discard(session_id)
+    
+    def can_select_role(self, role):
+        current_pacman = self.roles_taken["Pac-Man"]
+        current_ghosts = self.roles_taken["Ghost"]
+        
+        if role == "Pac-Man":
+            if current_pacman == 0:
+                return True
+            return current_ghosts >= (current_pacman * MAX_PACMAN_RATIO)
+        elif role == "Ghost":
+            return True
+        return False
     
-    player["last_move_time"] = current_time
+    def set_role(self, session_id, role):
+        entry = self.members[session_id]
+        if entry["role"]:
+            self.roles_taken[entry["role"]] -= 1
+        else:
+            self.unassigned -= 1
+        entry["role"] = role
+        self.roles_taken[role] += 1
+        self.changed[entry["name"]] = entry
+        self.schedule_flush()
     
-    dx, dy = DIRECTIONS.get(direction, (0, 0))
-    nx, ny = player["x"] + dx, player["y"] + dy
+    def all_ready(self):
+        """Everyone has a role and both sides are represented"""
+        return (bool(self.members) and self.unassigned == 0
+                and self.roles_taken["Pac-Man"] > 0 and self.roles_taken["Ghost"] > 0)
     
-    # Handle wrapping
-    nx, ny = wrap_position(nx, ny)
+    def send(self, session_id, message):
+        """One-off message to a member (session id, errors, start_game); diffs can't supersede it"""
+        conn = self.conns.get(session_id)
+        if conn is not None:
+            conn.push_control(encode_json(message))
     
-    # Check if valid move
-    if 0 <= ny < len(GAME_MAP) and 0 <= nx < len(GAME_MAP[0]):
-        # Ghosts can move through ghost pen, others can't
-        if is_ghost_pen(nx, ny) and player["role"] == "Pac-Man":
+    def schedule_flush(self):
+        if self.flush_task is not None or not self.conns:
+            return
+        self.flush_task = asyncio.create_task(self.flush_later())
+    
+    async def flush_later(self):
+        await asyncio.sleep(LOBBY_FLUSH_INTERVAL)
+        self.flush_task = None
+        self.flush()
+    
+    def flush(self):
+        """Send the batched changes to everyone, and the full list to newcomers"""
+        if not self.changed and not self.needs_snapshot:
             return
+        status = {
+            "roles_taken": self.roles_taken,
+            "can_select_pacman": self.can_select_role("Pac-Man"),
+            "can_select_ghost": self.can_select_role("Ghost"),
+        }
+        diff = encode_json({
+            "lobby_diff": {
+                "changed": [entry for entry in self.changed.values() if entry is not None],
+                "left": [name for name, entry in self.changed.items() if entry is None],
+            },
+            **status,
+        }) if self.changed else None
+        snapshot = encode_json({"lobby": list(self.members.values()), **status}) if self.needs_snapshot else None
+        self.changed = {}
         
-        if not is_wall(nx, ny):
-            player["x"], player["y"] = nx, ny
-            
-            # Only Pac-Man can eat pellets and fruits
-            if player["role"] == "Pac-Man":
-                tile = GAME_MAP[ny][nx]
-                
-                # Eat regular pellet
-                if tile == ".":
-                    player["score"] += 10
-                    GAME_MAP[ny][nx] = " "
-                    pellets_eaten_for_fruit += 1
-                    
-                    # Check win condition
-                    if count_pellets() == 0:
-                        game_over = True
-                        winner = max(players.values(), key=lambda p: p["score"])
-                    
-                    # Spawn fruit
-                    if pellets_eaten_for_fruit >= PELLETS_PER_FRUIT:
-                        spawn_fruit()
-                        pellets_eaten_for_fruit = 0
-                
-                # Eat power pellet
-                elif tile == "@":
-                    player["score"] += 50
-                    player["powered_up_until"] = time.time() + POWER_PELLET_DURATION
-                    player["ghosts_eaten_combo"] = 0  # Reset combo
-                    GAME_MAP[ny][nx] = " "
-                    pellets_eaten_for_fruit += 1
-                    
-                    # Check win condition
-                    if count_pellets() == 0:
-                        game_over = True
-                        winner = max(players.values(), key=lambda p: p["score"])
-                
-                # Eat fruit
-                for fruit in fruits[:]:
-                    if fruit["x"] == nx and fruit["y"] == ny:
-                        player["score"] += fruit["points"]
-                        fruits.remove(fruit)
-
-def get_ghost_target(ghost, behavior):
-    """Get target position for AI ghost based on behavior"""
-    # Find nearest Pac-Man
-    pacman_players = [p for p in players.values() if p["role"] == "Pac-Man" and p.get("is_alive", True)]
-    if not pacman_players:
-        return (14, 14)  # Center if no Pac-Man
-    
-    target_pacman = min(pacman_players, 
-                       key=lambda p: abs(p["x"] - ghost["x"]) + abs(p["y"] - ghost["y"]))
-    
-    if ghost_mode == "scatter":
-        # Go to corners
-        corners = [(1, 1), (26, 1), (1, 29), (26, 29)]
-        ghost_idx = ai_ghosts.index(ghost) if ghost in ai_ghosts else 0
-        return corners[ghost_idx % len(corners)]
-    
-    # Chase mode behaviors
-    if behavior == "chase":
-        # Direct chase
-        return (target_pacman["x"], target_pacman["y"])
-    
-    elif behavior == "ambush":
-        # Target 4 tiles ahead of Pac-Man
-        # (simplified - in real Pac-Man this considers direction)
-        return (target_pacman["x"] + 4, target_pacman["y"])
-    
-    elif behavior == "patrol":
-        # Patrol a specific area
-        patrol_points = [(7, 7), (20, 7), (20, 23), (7, 23)]
-        ghost_idx = ai_ghosts.index(ghost) if ghost in ai_ghosts else 0
-        return patrol_points[ghost_idx % len(patrol_points)]
-    
-    else:  # random
-        return (random.randint(1, 26), random.randint(1, 29))
-
-def move_ai_ghost(ghost, behavior):
-    """Move AI ghost with pathfinding"""
-    # If frightened (any Pac-Man powered up), move randomly
-    frightened = any(is_powered_up(p) for p in players.values() if p["role"] == "Pac-Man")
-    
-    if frightened:
-        # Random movement when frightened
-        directions = list(DIRECTIONS.values())
-        random.shuffle(directions)
-        for dx, dy in directions:
-            nx, ny = ghost["x"] + dx, ghost["y"] + dy
-            nx, ny = wrap_position(nx, ny)
-            if 0 <= ny < len(GAME_MAP) and 0 <= nx < len(GAME_MAP[0]):
-                if not is_wall(nx, ny):
-                    ghost["x"], ghost["y"] = nx, ny
-                    break
-    else:
-        # Smart movement toward target
-        target_x, target_y = get_ghost_target(ghost, behavior)
+        needs_snapshot, self.needs_snapshot = self.needs_snapshot, set()
+        for sid, conn in self.conns.items():
+            message = snapshot if sid in needs_snapshot else diff
+            if message is not None and not conn.push(message):
+                # Fell behind; catch it up with the full list next time
+                self.needs_snapshot.add(sid)
+        if self.needs_snapshot:
+            self.schedule_flush()
+    
+    def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        for conn in self.conns.values():
+            conn.close(code=1001)  # Going away
+        self.conns.clear()
+
+# ===== GAME ROOM =====
+class GameRoom:
+    """One isolated match: map, lobby, players, AI ghosts and its own tick task"""
+    
+    def __init__(self, room_id, map_name=DEFAULT_MAP, seed=None):
+        self.room_id = room_id
         
-        best_move = None
-        best_dist = float('inf')
+        # Determinism: game logic reads only this clock and this RNG
+        self.seed = random.getrandbits(63) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.clock = GameClock(time.time())
+        self.recorder = None  # replay.Recorder while RECORD_DIR is set
         
-        for direction, (dx, dy) in DIRECTIONS.items():
-            nx, ny = ghost["x"] + dx, ghost["y"] + dy
-            nx, ny = wrap_position(nx, ny)
-            
-            if 0 <= ny < len(GAME_MAP) and 0 <= nx < len(GAME_MAP[0]):
-                if not is_wall(nx, ny):
-                    dist = abs(nx - target_x) + abs(ny - target_y)
-                    if dist < best_dist:
-                        best_dist = dist
-                        best_move = (nx, ny)
+        # Game state
+        self.map_name = map_name
+        self.map = MAPS[map_name]
+        self.reset_board()
+        self.game_level = 1
+        self.game_over = False
+        self.winner = None
         
-        if best_move:
-            ghost["x"], ghost["y"] = best_move
-
-def check_collisions():
-    """Check for collisions between Pac-Man and Ghosts"""
-    global game_over
+        # Lobby and lifecycle
+        self.lobby = Lobby()
+        self.state = ROOM_LOBBY
+        self.state_since = time.monotonic()
+        self.last_activity = self.state_since  # Last lobby or game message from any client
+        self.disconnected = {}  # session_id -> monotonic deadline to resume by
+        self.match_started = self.clock()
+        self.departed = []  # Stats rows of players who left the game in progress
+        
+        # Players and AI ghosts
+        self.players: Dict[str, Player] = {}
+        self.pacmen: List[Player] = []  # Role-partitioned views of players, in join order
+        self.ghosts: List[Player] = []
+        self.conns = {}  # session_id -> ClientConnection for the game socket
+        self.wire_formats = {}  # session_id -> "json" or "binary"
+        # Interest management
+        self.viewers = {}  # session_id -> Viewport
+        self.chunk_subscribers = {}  # (cx, cy) -> set of viewer session ids
+        self.changed_cells = set()  # Cells whose visible content may have changed this tick
+        self.last_view_status = None
+        self.view_ticks = 0
+        self.minimap_walls = self.map.block_walls(MINIMAP_SCALE)
+        
+        self.occupancy = {}  # cell index -> set of entity keys, ("player", sid) or ("ai", slot)
+        self.dirty_cells = set()  # Cells entered since the last collision check
+        self.ai_ghosts = [AIGhost(slot, x, y, char) for slot, (x, y, char) in enumerate(self.map.ai_ghost_spawns)]
+        for ghost in self.ai_ghosts:
+            self.occupy(("ai", ghost.slot), ghost.x, ghost.y)
+        self.ghost_mode = "scatter"  # "scatter" or "chase"
+        self.ghost_mode_timer = 0
+        self.ai_ghost_timer = 0
+        
+        # Fruits
+        self.fruits = []  # {"x", "y", "type", "points", "spawn_time"}
+        self.pellets_eaten_for_fruit = 0
+        
+        # Tick state
+        self.pending_inputs = {}  # session_id -> (direction, expires), one buffered turn each
+        self.restart_requested = False
+        self.tick_task = None
+        self.tick_stats = {
+            "ticks": 0,
+            "overruns": 0,
+            "last_ms": 0.0,
+            "avg_ms": 0.0,
+            "max_ms": 0.0,
+            "budget_ms": TICK_INTERVAL * 1000,
+            "headroom_ms": TICK_INTERVAL * 1000,
+        }
+        self.tick_error_logged = None  # perf_counter time of the last traceback printed
+        self.tick_errors_suppressed = 0
+        
+        # Delta protocol state
+        self.broadcast_seq = 0
+        self.last_frame = None  # Last frame sent, deltas are computed against it
+        self.needs_keyframe = set()  # Sessions that get a full board on the next broadcast
+        self.binary_seq = 0
+        self.last_tiles = None  # Binary protocol: tile codes, entities and status last sent
+        self.last_entities = None
+        self.last_status = None
+        
+        # Spectators: one keyframe per wire format every SPECTATOR_INTERVAL ticks, shared by all
+        self.spectators = {wire_format: set() for wire_format in WIRE_FORMATS}  # -> ClientConnections
+        self.spectator_frames = {}  # wire_format -> latest encoded frame
+        self.spectator_seq = 0
+        self.spectator_ticks = 0
+        self.feed_task = None
+    
+    # ----- Game functions -----
+    def reset_game(self):
+        self.reset_board()
+        self.needs_keyframe.update(self.viewers)
+        self.game_level = 1
+        self.game_over = False
+        self.winner = None
+        self.pellets_eaten_for_fruit = 0
+        self.fruits = []
+        self.ghost_mode = "scatter"
+        self.ghost_mode_timer = self.clock()
+        self.match_started = self.clock()
+        self.departed = []
+        
+        # Reset all player stats
+        for player in self.players.values():
+            player.score = 0
+            player.lives = STARTING_LIVES
+            player.powered_up_until = 0
+            player.ghosts_eaten_combo = 0
+            player.ghosts_eaten = player.fruits_eaten = player.lives_lost = 0
+            player.alive = True
+            self.respawn_player(player)
+        
+        # AI ghosts go home too, or one parked on a Pac-Man spawn kills every respawn
+        spawns = self.map.ai_ghost_spawns or self.map.ghost_spawns
+        for ghost in self.ai_ghosts:
+            x, y = spawns[ghost.slot % len(spawns)][:2]
+            self.relocate(("ai", ghost.slot), ghost, x, y)
+            ghost.in_pen = False
+    
+    def reset_board(self):
+        """Fresh copy of the map's board buffer and pellet set"""
+        # Newline-separated rows, edited in place as pellets are eaten
+        self.board = bytearray(self.map.board)
+        self.board_version = 0  # Bumped on every board edit, keys the render cache
+        self.render_cache = (None, None)
+        self.pellet_positions = {self.map.position(i) for i in self.map.pellet_cells}  # Remaining (x, y) pellets
+        
+        # Pellets left per minimap cell, so the minimap never rescans the board
+        self.minimap_width = -(-self.map.width // MINIMAP_SCALE)
+        self.minimap_pellets = array("i", [0]) * (self.minimap_width * -(-self.map.height // MINIMAP_SCALE))
+        for x, y in self.pellet_positions:
+            self.minimap_pellets[(y // MINIMAP_SCALE) * self.minimap_width + x // MINIMAP_SCALE] += 1
+    
+    def tile_at(self, x, y):
+        return chr(self.board[y * self.map.board_stride + x])
+    
+    def count_pellets(self):
+        """Count remaining pellets on the map"""
+        return len(self.pellet_positions)
+    
+    def eat_pellet(self, x, y):
+        """Clear a pellet cell and check the win condition"""
+        self.board[y * self.map.board_stride + x] = ord(" ")
+        self.board_version += 1
+        self.pellet_positions.discard((x, y))
+        self.minimap_pellets[(y // MINIMAP_SCALE) * self.minimap_width + x // MINIMAP_SCALE] -= 1
+        self.changed_cells.add(self.map.index(x, y))
+        self.pellets_eaten_for_fruit += 1
+        
+        if not self.pellet_positions:
+            self.game_over = True
+            self.winner = max(self.players.values(), key=lambda p: p.score)
+    
+    def any_pacman_powered(self):
+        now = self.clock()
+        return any(now < p.powered_up_until for p in self.pacmen)
+    
+    # ----- Occupancy -----
+    def occupy(self, key, x, y):
+        cell = self.map.index(x, y)
+        entities = self.occupancy.get(cell)
+        if entities is None:
+            self.occupancy[cell] = {key}
+        else:
+            entities.add(key)
+        self.dirty_cells.add(cell)
+        self.changed_cells.add(cell)
+    
+    def vacate(self, key, x, y):
+        cell = self.map.index(x, y)
+        entities = self.occupancy.get(cell)
+        if entities is not None:
+            entities.discard(key)
+            if not entities:
+                del self.occupancy[cell]
+        self.changed_cells.add(cell)
+    
+    def relocate(self, key, entity, x, y):
+        """Move an entity and keep the occupancy index in step"""
+        self.vacate(key, entity.x, entity.y)
+        entity.x, entity.y = x, y
+        self.occupy(key, x, y)
+    
+    def entity(self, key):
+        kind, ref = key
+        if kind == "ai":
+            return self.ai_ghosts[ref]
+        return self.players.get(ref)
+    
+    def respawn_player(self, player):
+        """Respawn a player at their starting position"""
+        if player.role == PACMAN:
+            same_role, spawns = self.pacmen, self.map.pacman_spawns
+        else:
+            same_role, spawns = self.ghosts, self.map.ghost_spawns
+        idx = same_role.index(player) if player in same_role else 0
+        spawn_x, spawn_y = spawns[idx % len(spawns)]
+        
+        self.relocate(("player", player.sid), player, spawn_x, spawn_y)
+        player.last_move_time = self.clock()
+        player.direction = None
+    
+    def add_player(self, session_id, conn, wire_format="json"):
+        """Create the in-game player for a lobby session"""
+        if session_id in self.players:
+            self.remove_player(session_id)  # Start over rather than index it twice
+        self.disconnected.pop(session_id, None)
+        role_name = self.lobby.members[session_id]["role"]
+        role = ROLE_IDS[role_name]
+        char = player_chars[len(self.players) % len(player_chars)]
+        
+        if role == PACMAN:
+            same_role, spawns = self.pacmen, self.map.pacman_spawns
+        else:
+            same_role, spawns = self.ghosts, self.map.ghost_spawns
+        spawn_x, spawn_y = spawns[len(same_role) % len(spawns)]
+        
+        player = Player(session_id, spawn_x, spawn_y, char, role, self.clock())
+        self.players[session_id] = player
+        same_role.append(player)
+        self.conns[session_id] = conn
+        self.wire_formats[session_id] = wire_format
+        self.occupy(("player", session_id), spawn_x, spawn_y)
+        self.needs_keyframe.add(session_id)
+        if self.recorder is not None:
+            self.recorder.join(session_id, role_name)
+    
+    def remove_player(self, session_id):
+        self.remove_viewer(session_id)
+        self.disconnected.pop(session_id, None)
+        player = self.players.pop(session_id, None)
+        if player is not None:
+            if stats_store is not None and self.state == ROOM_RUNNING:
+                self.departed.append(self.match_row(player, finished=False))
+            (self.pacmen if player.role == PACMAN else self.ghosts).remove(player)
+            self.vacate(("player", session_id), player.x, player.y)
+        self.conns.pop(session_id, None)
+        self.wire_formats.pop(session_id, None)
+        self.pending_inputs.pop(session_id, None)
+        self.needs_keyframe.discard(session_id)
+        if self.recorder is not None:
+            self.recorder.leave(session_id)
+    
+    def detach_player(self, session_id, conn):
+        """A player's socket dropped: the player stays in the game, unsent to, for RECONNECT_GRACE"""
+        if self.conns.get(session_id) is not conn:
+            return  # Already replaced by a newer socket
+        del self.conns[session_id]
+        del self.wire_formats[session_id]
+        self.remove_viewer(session_id)
+        self.needs_keyframe.discard(session_id)
+        self.disconnected[session_id] = time.monotonic() + RECONNECT_GRACE
+    
+    def resume_player(self, session_id, conn, wire_format="json"):
+        """Attach a new socket to an existing player, replacing any old one. False if there is none."""
+        if session_id not in self.players:
+            return False
+        self.disconnected.pop(session_id, None)
+        old = self.conns.get(session_id)
+        if old is not None and old is not conn:
+            old.close(code=1008)  # Policy violation: the session moved to another socket
+        self.remove_viewer(session_id)
+        self.conns[session_id] = conn
+        self.wire_formats[session_id] = wire_format
+        self.needs_keyframe.add(session_id)
+        return True
+    
+    def expired_sessions(self, now):
+        """Dropped or never-connected sessions whose grace window has passed"""
+        return [sid for sid, deadline in self.disconnected.items() if now >= deadline]
+    
+    def spawn_fruit(self):
+        """Spawn a fruit at a random empty location"""
+        # Find empty spaces
+        empty_spaces = []
+        for i in self.map.floor_cells:
+            x, y = self.map.position(i)
+            if self.tile_at(x, y) == " ":
+                empty_spaces.append((x, y))
+        
+        if empty_spaces:
+            x, y = self.rng.choice(empty_spaces)
+            fruit_type = FRUIT_TYPES[min(self.game_level - 1, len(FRUIT_TYPES) - 1)]
+            self.changed_cells.add(self.map.index(x, y))
+            self.fruits.append({
+                "x": x,
+                "y": y,
+                "type": fruit_type["char"],
+                "name": fruit_type["name"],
+                "points": fruit_type["points"],
+                "spawn_time": self.clock()
+            })
     
-    # Get all ghost positions
-    ghost_positions = {}
+    def update_fruits(self):
+        """Remove expired fruits"""
+        current_time = self.clock()
+        fresh = []
+        for fruit in self.fruits:
+            if current_time - fruit["spawn_time"] < FRUIT_DURATION:
+                fresh.append(fruit)
+            else:
+                self.changed_cells.add(self.map.index(fruit["x"], fruit["y"]))
+        self.fruits = fresh
     
-    # AI ghosts
-    for ghost in ai_ghosts:
-        ghost_positions[(ghost["x"], ghost["y"])] = ("ai", ghost)
+    def get_move_delay(self, player):
+        """Minimum delay between two moves for this player"""
+        if player.role == PACMAN:
+            return PACMAN_SPEED
+        # Ghost
+        if self.map.tunnels[self.map.index(player.x, player.y)]:
+            return GHOST_TUNNEL_SPEED
+        if self.any_pacman_powered():
+            return GHOST_FRIGHTENED_SPEED
+        return GHOST_SPEED
     
-    # Player ghosts
-    for sid, player in players.items():
-        if player["role"] == "Ghost" and player.get("is_alive", True):
-            ghost_positions[(player["x"], player["y"])] = ("player", sid)
+    def can_move(self, player, current_time):
+        """Check the movement speed throttle"""
+        return current_time - player.last_move_time >= self.get_move_delay(player)
+    
+    def step_target(self, player, direction):
+        """Cell the player would enter going ``direction``, or -1 if it is blocked"""
+        target = self.map.step(player.x, player.y, direction)
+        # Ghosts can move through ghost pen, others can't
+        if target >= 0 and self.map.pen[target] and player.role == PACMAN:
+            return -1
+        return target
     
-    # Check each Pac-Man
-    for pac_sid, pacman in list(players.items()):
-        if pacman["role"] != "Pac-Man" or not pacman.get("is_alive", True):
-            continue
+    def move_player(self, player, direction):
+        if not player.alive:
+            return
+        
+        # Check movement speed throttle
+        current_time = self.clock()
+        if not self.can_move(player, current_time):
+            return  # Too soon to move
+        
+        player.last_move_time = current_time
         
-        pac_pos = (pacman["x"], pacman["y"])
+        target = self.step_target(player, direction)
+        if target < 0:
+            return  # Wall
         
-        if pac_pos in ghost_positions:
-            ghost_type, ghost_ref = ghost_positions[pac_pos]
+        player.direction = direction
+        nx, ny = self.map.position(target)
+        self.relocate(("player", player.sid), player, nx, ny)
+        
+        # Only Pac-Man can eat pellets and fruits
+        if player.role == PACMAN:
+            tile = self.tile_at(nx, ny)
             
-            if is_powered_up(pacman):
-                # Pac-Man eats ghost!
-                combo_idx = min(pacman["ghosts_eaten_combo"], len(GHOST_DEATH_SCORES) - 1)
-                points = GHOST_DEATH_SCORES[combo_idx]
-                pacman["score"] += points
-                pacman["ghosts_eaten_combo"] += 1
+            # Eat regular pellet
+            if tile == ".":
+                player.score += 10
+                self.eat_pellet(nx, ny)
                 
-                # Respawn ghost
-                if ghost_type == "ai":
-                    ghost = ghost_ref
-                    ghost["x"], ghost["y"] = GHOST_SPAWNS[ai_ghosts.index(ghost) % len(GHOST_SPAWNS)]
-                    ghost["in_pen"] = True
-                else:  # player ghost
-                    ghost_player = players[ghost_ref]
-                    respawn_player(ghost_player)
+                # Spawn fruit
+                if self.pellets_eaten_for_fruit >= PELLETS_PER_FRUIT:
+                    self.spawn_fruit()
+                    self.pellets_eaten_for_fruit = 0
+            
+            # Eat power pellet
+            elif tile == "@":
+                player.score += 50
+                player.powered_up_until = current_time + POWER_PELLET_DURATION
+                player.ghosts_eaten_combo = 0  # Reset combo
+                self.eat_pellet(nx, ny)
+            
+            # Eat fruit
+            for fruit in self.fruits[:]:
+                if fruit["x"] == nx and fruit["y"] == ny:
+                    player.score += fruit["points"]
+                    player.fruits_eaten += 1
+                    self.fruits.remove(fruit)
+    
+    def ghost_targets(self):
+        """Target cell of every AI ghost, in ghost order.
+        
+        Mode, live Pac-Men and the fixed targets are looked up once for the
+        whole pass, and each ghost's nearest Pac-Man once per occupied cell.
+        Random targets draw from the RNG in ghost order, as one ghost at a
+        time would.
+        """
+        cmap = self.map
+        ghosts = self.ai_ghosts
+        live = [p for p in self.pacmen if p.alive]
+        if not live:
+            return [cmap.target_cell(*cmap.home)] * len(ghosts)  # Center if no Pac-Man
+        
+        if self.ghost_mode == "scatter":
+            # Go to corners
+            corners = [cmap.target_cell(x, y) for x, y in cmap.scatter_targets]
+            return [corners[ghost.slot % len(corners)] for ghost in ghosts]
+        
+        # Chase mode behaviors
+        patrol_points = [cmap.target_cell(x, y) for x, y in cmap.patrol_points]
+        nearest = {}  # ghost cell -> nearest live Pac-Man by grid distance
+        targets = []
+        for i, ghost in enumerate(ghosts):
+            behavior = GHOST_BEHAVIORS[i % len(GHOST_BEHAVIORS)]
+            if behavior == "patrol":
+                # Patrol a specific area
+                targets.append(patrol_points[ghost.slot % len(patrol_points)])
+            elif behavior == "random":
+                # Keep a random target until it's reached so the path stays cached
+                target = ghost.random_target
+                if target is None or target == (ghost.x, ghost.y):
+                    cell = cmap.target_cell(self.rng.randint(1, cmap.width - 2),
+                                            self.rng.randint(1, cmap.height - 2))
+                    target = cmap.position(cell)
+                    ghost.random_target = target
+                targets.append(cmap.target_cell(*target))
+            else:
+                x, y = ghost.x, ghost.y
+                pacman = nearest.get((x, y))
+                if pacman is None:
+                    pacman = live[0] if len(live) == 1 else min(live, key=lambda p: abs(p.x - x) + abs(p.y - y))
+                    nearest[(x, y)] = pacman
+                if behavior == "chase":
+                    # Direct chase
+                    targets.append(cmap.target_cell(pacman.x, pacman.y))
+                else:
+                    # Ambush: 4 tiles ahead of Pac-Man
+                    # (simplified - in real Pac-Man this considers direction)
+                    targets.append(cmap.target_cell(pacman.x + 4, pacman.y))
+        return targets
+    
+    def move_ai_ghosts(self):
+        """Move every AI ghost one step, as one pass.
+        
+        Frightened ghosts (any Pac-Man powered up) wander at random. The rest
+        are grouped by target so each BFS distance field is fetched once and
+        the whole group steps along it.
+        """
+        ghosts = self.ai_ghosts
+        if not ghosts:
+            return
+        cmap = self.map
+        width = cmap.width
+        cells = [ghost.y * width + ghost.x for ghost in ghosts]
+        
+        if self.any_pacman_powered():
+            choice = self.rng.choice
+            neighbors = cmap.neighbors
+            steps = [choice(options) if options else -1 for options in map(neighbors.__getitem__, cells)]
+            self.shift_ai_ghosts(cells, steps)
+            return
+        
+        groups = {}  # target cell -> indices of the ghosts heading there
+        for i, target in enumerate(self.ghost_targets()):
+            group = groups.get(target)
+            if group is None:
+                groups[target] = [i]
+            else:
+                group.append(i)
+        
+        steps = [-1] * len(ghosts)
+        for target, group in groups.items():
+            for i, step in zip(group, cmap.next_steps([cells[i] for i in group], target)):
+                steps[i] = step
+        self.shift_ai_ghosts(cells, steps)
+    
+    def shift_ai_ghosts(self, cells, steps):
+        """Move AI ghost ``i`` from ``cells[i]`` to ``steps[i]`` (-1 stays put, untouched).
+        
+        ``relocate`` for the whole list at once, on flat cell indices.
+        """
+        occupancy = self.occupancy
+        dirty = self.dirty_cells
+        changed = self.changed_cells
+        width = self.map.width
+        for ghost, cell, step in zip(self.ai_ghosts, cells, steps):
+            if step < 0:
+                continue
+            key = ("ai", ghost.slot)
+            entities = occupancy.get(cell)
+            if entities is not None:
+                entities.discard(key)
+                if not entities:
+                    del occupancy[cell]
+            ghost.y, ghost.x = divmod(step, width)
+            entities = occupancy.get(step)
+            if entities is None:
+                occupancy[step] = {key}
             else:
-                # Ghost catches Pac-Man!
-                pacman["lives"] -= 1
-                pacman["powered_up_until"] = 0  # Lose power-up
+                entities.add(key)
+            dirty.add(step)
+            changed.add(cell)
+            changed.add(step)
+    
+    def check_collisions(self):
+        """Resolve Pac-Man/ghost collisions in the cells entered since the last check"""
+        now = self.clock()
+        dirty, self.dirty_cells = self.dirty_cells, set()
+        
+        for cell in dirty:
+            keys = self.occupancy.get(cell)
+            if keys is None or len(keys) < 2:
+                continue
+            
+            # Sorted so stacked entities resolve in a stable order
+            pacmen = []
+            ghosts = []
+            for key in sorted(keys):
+                entity = self.entity(key)
+                if key[0] == "ai":
+                    ghosts.append((key, entity))
+                elif not entity.alive:
+                    continue
+                elif entity.role == PACMAN:
+                    pacmen.append(entity)
+                else:
+                    ghosts.append((key, entity))
+            
+            for pacman in pacmen:
+                if not ghosts:
+                    break
                 
-                if pacman["lives"] <= 0:
-                    pacman["is_alive"] = False
-                    # Check if all Pac-Men are dead
-                    if not any(p.get("is_alive", True) for p in players.values() if p["role"] == "Pac-Man"):
-                        game_over = True
-                        # Ghosts win
-                        winner = max(
-                            (p for p in players.values() if p["role"] == "Ghost"),
-                            key=lambda p: p.get("score", 0),
-                            default=None
-                        )
+                if is_powered_up(pacman, now):
+                    # Pac-Man eats every ghost on the cell!
+                    for (ghost_type, ghost_ref), ghost in ghosts:
+                        combo_idx = min(pacman.ghosts_eaten_combo, len(GHOST_DEATH_SCORES) - 1)
+                        points = GHOST_DEATH_SCORES[combo_idx]
+                        pacman.score += points
+                        pacman.ghosts_eaten_combo += 1
+                        pacman.ghosts_eaten += 1
+                        
+                        # Respawn ghost
+                        if ghost_type == "ai":
+                            spawns = self.map.ghost_spawns
+                            self.relocate((ghost_type, ghost_ref), ghost,
+                                          *spawns[ghost.slot % len(spawns)])
+                            ghost.in_pen = True
+                        else:  # player ghost
+                            self.respawn_player(ghost)
+                    ghosts = []
                 else:
-                    respawn_player(pacman)
-
-def render_board():
-    """Render the game board with all entities"""
-    board = copy.deepcopy(GAME_MAP)
-    
-    # Draw fruits
-    for fruit in fruits:
-        board[fruit["y"]][fruit["x"]] = fruit["type"]
-    
-    # Draw AI ghosts
-    for ghost in ai_ghosts:
-        if not ghost.get("in_pen", False):
-            board[ghost["y"]][ghost["x"]] = ghost["char"]
-    
-    # Draw players
-    for player in players.values():
-        if player.get("is_alive", True):
-            board[player["y"]][player["x"]] = player["char"]
-    
-    return "\n".join("".join(row) for row in board)
-
-def get_game_state():
-    """Get complete game state for clients"""
-    power_status = {}
-    for sid, player in players.items():
-        if player["role"] == "Pac-Man":
-            powered = is_powered_up(player)
-            time_left = get_power_time_left(player)
-            flashing = should_flash_power(player)
-            power_status[player["char"]] = {
+                    # Ghost catches Pac-Man!
+                    pacman.lives -= 1
+                    pacman.lives_lost += 1
+                    pacman.powered_up_until = 0  # Lose power-up
+                    
+                    if pacman.lives <= 0:
+                        pacman.alive = False
+                        self.changed_cells.add(cell)
+                        # Check if all Pac-Men are dead
+                        if not any(p.alive for p in self.pacmen):
+                            self.game_over = True
+                            # Ghosts win
+                            self.winner = max(self.ghosts, key=lambda p: p.score, default=None)
+                    else:
+                        self.respawn_player(pacman)
+    
+    def render_board(self):
+        """Render the game board with all entities.
+        
+        Entities are patched into the board buffer, read out and restored, so a
+        render costs O(entities) on top of one copy of the buffer. The result
+        is reused until the board or any entity changes.
+        """
+        overlay = [(fruit["x"], fruit["y"], fruit["type"]) for fruit in self.fruits]
+        overlay.extend((ghost.x, ghost.y, ghost.char) for ghost in self.ai_ghosts if not ghost.in_pen)
+        overlay.extend((player.x, player.y, player.char) for player in self.players.values() if player.alive)
+        
+        key = (self.board_version, overlay)
+        cached_key, text = self.render_cache
+        if cached_key == key:
+            return text
+        
+        # Later entries draw on top: fruits, then AI ghosts, then players
+        board = self.board
+        stride = self.map.board_stride
+        saved = []
+        for x, y, char in overlay:
+            i = y * stride + x
+            saved.append((i, board[i]))
+            board[i] = ord(char)
+        text = board.decode("ascii")
+        for i, old in reversed(saved):
+            board[i] = old
+        
+        self.render_cache = (key, text)
+        return text
+    
+    def get_game_state(self, with_board=True):
+        """Get complete game state for clients"""
+        power_status = {}
+        now = self.clock()
+        for player in self.pacmen:
+            powered = is_powered_up(player, now)
+            time_left = get_power_time_left(player, now)
+            flashing = should_flash_power(player, now)
+            power_status[player.char] = {
                 "powered": powered,
                 "time_left": int(time_left),
                 "flashing": flashing
             }
+        
+        return {
+            "board": self.render_board() if with_board else None,
+            "power_status": power_status,
+            "level": self.game_level,
+            "pellets_left": self.count_pellets(),
+            "game_over": self.game_over,
+            "winner": self.winner.char if self.winner else None,
+            "fruits": self.fruits
+        }
     
-    return {
-        "board": render_board(),
-        "players": players,
-        "power_status": power_status,
-        "level": game_level,
-        "pellets_left": count_pellets(),
-        "game_over": game_over,
-        "winner": winner["char"] if winner else None,
-        "fruits": fruits
-    }
+    # ----- Broadcasting -----
+    def status_frame(self, state):
+        """Score and info text plus power and game-over flags, as sent to JSON clients"""
+        # Build score display
+        score_lines = []
+        for p in self.players.values():
+            # Only show lives for Pac-Man
+            if p.role == PACMAN:
+                line = f"{p.char}: {p.score} pts, Lives: {p.lives} ({p.role_name})"
+            else:  # Ghost
+                line = f"{p.char}: {p.score} pts ({p.role_name})"
+            
+            if p.role == PACMAN and p.char in state['power_status']:
+                ps = state['power_status'][p.char]
+                if ps['powered']:
+                    line += f" 💪 POWER! ({ps['time_left']}s)"
+                    if ps['flashing']:
+                        line += " ⚠️"
+            
+            if not p.alive:
+                line += " [DEAD]"
+            
+            score_lines.append(line)
+        
+        # Add game info
+        info_lines = [
+            f"Level: {state['level']} | Pellets Left: {state['pellets_left']}"
+        ]
+        
+        if state['fruits']:
+            fruit_info = ", ".join([f"{f['name']} ({f['points']}pts)" for f in state['fruits']])
+            info_lines.append(f"Fruits: {fruit_info}")
+        
+        if state['game_over']:
+            if state['winner']:
+                info_lines.append(f"🎉 GAME OVER! Winner: {state['winner']} 🎉")
+            else:
+                info_lines.append("🎉 GAME OVER! 🎉")
+            info_lines.append("Send 'restart' to play again!")
+        
+        return {
+            "scores": "\n".join(score_lines),
+            "info": "\n".join(info_lines),
+            "power_status": state['power_status'],
+            "game_over": state['game_over']
+        }
+    
+    def build_json_messages(self):
+        """This tick's JSON delta (None if nothing changed) and a keyframe factory.
+        
+        Also returns whether every JSON client should get a keyframe this tick.
+        """
+        state = self.get_game_state()
+        frame = {"board": state['board'].split("\n"), **self.status_frame(state), "acks": self.input_acks()}
+        
+        force_keyframe = False
+        delta = None
+        if self.last_frame is None:
+            # Nothing to diff against yet, everyone starts from a keyframe
+            self.broadcast_seq += 1
+            force_keyframe = True
+        else:
+            delta = build_delta(self.last_frame, frame)
+        if delta:
+            self.broadcast_seq += 1
+            delta["type"] = "delta"
+            delta["seq"] = self.broadcast_seq
+            # Periodic keyframe for everyone
+            force_keyframe = self.broadcast_seq % KEYFRAME_INTERVAL == 0
+        self.last_frame = frame
+        
+        seq = self.broadcast_seq
+        sent_at = time.time()
+        if delta and FRAME_TIMESTAMPS:
+            delta["ts"] = sent_at
+        def make_keyframe():
+            keyframe = {
+                "type": "game_state",
+                "seq": seq,
+                "board": state['board'],
+                "scores": frame['scores'],
+                "info": frame['info'],
+                "power_status": frame['power_status'],
+                "game_over": frame['game_over'],
+                "acks": frame['acks']
+            }
+            if FRAME_TIMESTAMPS:
+                keyframe["ts"] = sent_at
+            return keyframe
+        return delta, make_keyframe, force_keyframe
+    
+    def input_acks(self):
+        """char -> [last input ack, x, y] for client-side reconciliation.
+        
+        Only live players that have had a numbered input acknowledged are
+        listed, so clients that don't predict add nothing to the frames.
+        """
+        return {p.char: [p.input_ack, p.x, p.y] for p in self.players.values() if p.alive and p.input_ack is not None}
+    
+    def entity_records(self):
+        """Fixed-width entity tuples for the binary protocol"""
+        records = []
+        now = self.clock()
+        for p in self.players.values():
+            kind = protocol.KIND_PACMAN if p.role == PACMAN else protocol.KIND_GHOST
+            flags = protocol.FLAG_ALIVE if p.alive else 0
+            power = 0
+            if is_powered_up(p, now):
+                flags |= protocol.FLAG_POWERED
+                if should_flash_power(p, now):
+                    flags |= protocol.FLAG_FLASHING
+                power = int(get_power_time_left(p, now))
+            ack = p.input_ack if p.input_ack is not None else 0  # Clients number inputs from 1
+            records.append((p.char, kind, flags, p.x, p.y, p.score, p.lives, power, ack))
+        for ghost in self.ai_ghosts:
+            flags = protocol.FLAG_ALIVE | (protocol.FLAG_IN_PEN if ghost.in_pen else 0)
+            records.append((ghost.char, protocol.KIND_AI_GHOST, flags, ghost.x, ghost.y, 0, 0, 0, 0))
+        return records
+    
+    def binary_status(self):
+        """Game-over flag, level, winner and pellets left, as in the binary frame header"""
+        return (
+            protocol.FLAG_GAME_OVER if self.game_over else 0,
+            self.game_level,
+            self.winner.char if self.winner else None,
+            self.count_pellets(),
+        )
+    
+    def build_binary_messages(self):
+        """Binary counterpart of build_json_messages"""
+        tiles = protocol.encode_tiles(self.board, self.map.width, self.fruits)
+        records = self.entity_records()
+        entities = protocol.encode_entities(records)
+        status = self.binary_status()
+        
+        force_keyframe = False
+        delta = None
+        if self.last_tiles is None:
+            self.binary_seq += 1
+            force_keyframe = True
+        else:
+            cells = protocol.diff_tiles(self.last_tiles, tiles)
+            if cells or entities != self.last_entities or status != self.last_status:
+                self.binary_seq += 1
+                delta = protocol.encode_delta((self.binary_seq, *status), entities, len(records), cells)
+                force_keyframe = self.binary_seq % KEYFRAME_INTERVAL == 0
+        self.last_tiles = tiles
+        self.last_entities = entities
+        self.last_status = status
+        
+        seq = self.binary_seq
+        def make_keyframe():
+            return protocol.encode_keyframe((seq, *status), entities, len(records),
+                                            self.map.width, self.map.height, tiles)
+        return delta, make_keyframe, force_keyframe
+    
+    def broadcast_game_state(self):
+        """Queue a delta for synced players and a keyframe for anyone who needs one.
+        
+        Every message is encoded once per tick and shared by all recipients.
+        """
+        viewers = self.viewers
+        wire_formats = self.wire_formats
+        if len(viewers) < len(wire_formats) and "json" in wire_formats.values():
+            # Render up front so the JSON builder hits the cache and "serialize" times only encoding
+            start = metrics.phase_start()
+            self.render_board()
+            metrics.phase_end("render_board", start)
+        
+        start = metrics.phase_start()
+        builders = {}
+        for sid, wire_format in wire_formats.items():
+            if sid in viewers:
+                continue
+            if wire_format not in builders:
+                if wire_format == "binary":
+                    delta, make_keyframe, force_keyframe = self.build_binary_messages()
+                else:
+                    delta, make_keyframe, force_keyframe = self.build_json_messages()
+                    if delta:
+                        delta = encode_json(delta)
+                builders[wire_format] = (delta, make_keyframe, force_keyframe)
+        
+        keyframes = {}
+        for sid, conn in self.conns.items():
+            if sid in viewers:
+                continue
+            wire_format = wire_formats[sid]
+            delta, make_keyframe, force_keyframe = builders[wire_format]
+            if force_keyframe or sid in self.needs_keyframe:
+                if wire_format not in keyframes:
+                    keyframe = make_keyframe()
+                    keyframes[wire_format] = keyframe if wire_format == "binary" else encode_json(keyframe)
+                conn.push(keyframes[wire_format], keyframe=True)
+                self.needs_keyframe.discard(sid)
+            elif delta:
+                if not conn.push(delta):
+                    # Client fell behind; resync it with a keyframe next tick
+                    self.needs_keyframe.add(sid)
+        
+        self.broadcast_views()
+        metrics.phase_end("serialize", start)
+    
+    # ----- Spectators -----
+    def add_spectator(self, conn, wire_format="json"):
+        self.spectators[wire_format].add(conn)
+        frame = self.spectator_frames.get(wire_format)
+        if frame is not None:
+            conn.push(frame, keyframe=True)
+    
+    def remove_spectator(self, conn, wire_format="json"):
+        self.spectators[wire_format].discard(conn)
+    
+    def spectator_count(self):
+        return sum(len(conns) for conns in self.spectators.values())
+    
+    def spectator_frame(self, wire_format):
+        """A standalone keyframe: spectators skip frames, so they never get deltas"""
+        if wire_format == "binary":
+            tiles = protocol.encode_tiles(self.board, self.map.width, self.fruits)
+            records = self.entity_records()
+            return protocol.encode_keyframe((self.spectator_seq, *self.binary_status()),
+                                            protocol.encode_entities(records), len(records),
+                                            self.map.width, self.map.height, tiles)
+        state = self.get_game_state()
+        return encode_json({"type": "game_state", "seq": self.spectator_seq, "board": state["board"],
+                            **self.status_frame(state)})
+    
+    def publish_spectator_frame(self):
+        """Encode this tick's spectator frames and hand them to the feed task.
+        
+        The tick only encodes, once per wire format in use; the fan-out to
+        sockets runs afterwards in batches.
+        """
+        self.spectator_seq += 1
+        self.spectator_frames = {
+            wire_format: self.spectator_frame(wire_format)
+            for wire_format, conns in self.spectators.items() if conns
+        }
+        if self.feed_task is None:
+            self.feed_task = asyncio.create_task(self.feed_spectators())
+    
+    async def feed_spectators(self):
+        """Push the newest spectator frame to every watcher, yielding every SPECTATOR_BATCH sockets.
+        
+        A watcher's queue holds one frame, so one that is still sending the
+        previous frame gets the newest instead of a backlog.
+        """
+        try:
+            fed_seq = None
+            while fed_seq != self.spectator_seq:
+                fed_seq = self.spectator_seq
+                frames = self.spectator_frames
+                sent = 0
+                for wire_format, conns in self.spectators.items():
+                    frame = frames.get(wire_format)
+                    if frame is None:
+                        continue
+                    for conn in list(conns):
+                        conn.push(frame, keyframe=True)
+                        sent += 1
+                        if sent % SPECTATOR_BATCH == 0:
+                            await asyncio.sleep(0)  # Let ticks and player sends run
+        finally:
+            self.feed_task = None
+    
+    # ----- Interest management -----
+    def add_viewer(self, session_id, radius):
+        """Switch a player's connection to viewport updates"""
+        self.viewers[session_id] = Viewport(max(1, min(radius, MAX_VIEW_RADIUS)))
+        self.needs_keyframe.add(session_id)
+    
+    def remove_viewer(self, session_id):
+        view = self.viewers.pop(session_id, None)
+        if view is not None:
+            self.subscribe_chunks(session_id, view, set())
+    
+    def view_chunks(self, x, y, radius):
+        """Chunks overlapping the square view around (x, y)"""
+        last_cx = (self.map.width - 1) // CHUNK_SIZE
+        last_cy = (self.map.height - 1) // CHUNK_SIZE
+        cx0, cx1 = max(0, (x - radius) // CHUNK_SIZE), min(last_cx, (x + radius) // CHUNK_SIZE)
+        cy0, cy1 = max(0, (y - radius) // CHUNK_SIZE), min(last_cy, (y + radius) // CHUNK_SIZE)
+        return {(cx, cy) for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1)}
+    
+    def subscribe_chunks(self, session_id, view, wanted):
+        """Move a viewer's entries in the subscription grid to the chunks in ``wanted``"""
+        for chunk in view.chunks - wanted:
+            subscribers = self.chunk_subscribers[chunk]
+            subscribers.discard(session_id)
+            if not subscribers:
+                del self.chunk_subscribers[chunk]
+        for chunk in wanted - view.chunks:
+            self.chunk_subscribers.setdefault(chunk, set()).add(session_id)
+        view.chunks = wanted
+    
+    def cell_char(self, cell, fruit_at):
+        """What a cell shows: player over AI ghost over fruit over the board"""
+        keys = self.occupancy.get(cell)
+        if keys:
+            # Same stacking as render_board: later players, then later AI ghosts win
+            players = [self.players[sid] for kind, sid in keys if kind == "player"]
+            if len(players) > 1:
+                order = list(self.players)
+                players.sort(key=lambda p: order.index(p.sid))
+            for player in reversed(players):
+                if player.alive:
+                    return player.char
+            for kind, slot in sorted(keys, reverse=True):
+                if kind == "ai" and not self.ai_ghosts[slot].in_pen:
+                    return self.ai_ghosts[slot].char
+        fruit = fruit_at.get(cell)
+        if fruit:
+            return fruit
+        x, y = self.map.position(cell)
+        return self.tile_at(x, y)
+    
+    def chunk_rows(self, chunk, fruit_at):
+        cx, cy = chunk
+        x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+        x1 = min(x0 + CHUNK_SIZE, self.map.width)
+        y1 = min(y0 + CHUNK_SIZE, self.map.height)
+        index = self.map.index
+        return ["".join(self.cell_char(index(x, y), fruit_at) for x in range(x0, x1)) for y in range(y0, y1)]
+    
+    def minimap(self):
+        """Coarse whole-map summary: pellets left, solid walls and where the players are"""
+        rows = []
+        width = self.minimap_width
+        for start in range(0, len(self.minimap_pellets), width):
+            rows.append("".join(
+                "." if self.minimap_pellets[i] else ("#" if self.minimap_walls[i] else " ")
+                for i in range(start, start + width)
+            ))
+        entities = [[p.char, p.x, p.y] for p in self.players.values() if p.alive]
+        return {"type": "minimap", "scale": MINIMAP_SCALE, "rows": rows, "entities": entities}
+    
+    def broadcast_views(self):
+        """Send each viewer only what changed in its own chunks.
+        
+        Changed cells fan out through the chunk subscription grid, so the
+        work per viewer follows its view size rather than the map size.
+        """
+        changed, self.changed_cells = self.changed_cells, set()
+        if not self.viewers:
+            return
+        
+        for cell in changed:
+            x, y = self.map.position(cell)
+            subscribers = self.chunk_subscribers.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+            if subscribers:
+                for sid in subscribers:
+                    self.viewers[sid].pending.append(cell)
+        
+        status = self.status_frame(self.get_game_state(with_board=False))
+        last_status = self.last_view_status
+        status_delta = {k: v for k, v in status.items() if last_status is None or last_status[k] != v}
+        self.last_view_status = status
+        
+        self.view_ticks += 1
+        minimap = encode_json(self.minimap()) if self.view_ticks % MINIMAP_INTERVAL == 1 else None
+        fruit_at = {self.map.index(f["x"], f["y"]): f["type"] for f in self.fruits}
+        
+        for sid, view in self.viewers.items():
+            player = self.players[sid]
+            message = {}
+            reset = sid in self.needs_keyframe
+            if reset:
+                self.needs_keyframe.discard(sid)
+                self.subscribe_chunks(sid, view, set())
+                view.pending.clear()
+                view.seq = 0
+                view.center = None
+                view.ack = None
+                message.update(status, reset=True, width=self.map.width, height=self.map.height, chunk=CHUNK_SIZE)
+            elif status_delta:
+                message.update(status_delta)
+            
+            if view.pending:
+                cells = set(view.pending)
+                view.pending.clear()
+                message["cells"] = [[*self.map.position(cell), self.cell_char(cell, fruit_at)] for cell in cells]
+            
+            wanted = self.view_chunks(player.x, player.y, view.radius)
+            if wanted != view.chunks:
+                added = wanted - view.chunks
+                removed = view.chunks - wanted
+                self.subscribe_chunks(sid, view, wanted)
+                if added:
+                    message["chunks"] = {f"{cx},{cy}": self.chunk_rows((cx, cy), fruit_at) for cx, cy in added}
+                if removed:
+                    message["drop"] = [f"{cx},{cy}" for cx, cy in removed]
+            
+            center = [player.x, player.y]
+            if center != view.center:
+                view.center = center
+                message["center"] = center
+            ack = player.input_ack if player.input_ack is not None else 0
+            if ack != view.ack:
+                view.ack = ack
+                message["ack"] = ack
+            
+            conn = self.conns[sid]
+            if message:
+                view.seq += 1
+                message.update(type="view", seq=view.seq)
+                if not conn.push(encode_json(message), keyframe=reset):
+                    self.needs_keyframe.add(sid)
+                    continue
+            if minimap and not conn.push(minimap):
+                self.needs_keyframe.add(sid)
+    
+    # ----- Tick loop -----
+    def queue_move(self, session_id, direction, seq=None):
+        """Buffer a turn; a newer one replaces any turn not yet taken.
+        
+        ``seq`` is the client's input number, acknowledged in the frames once
+        the turn is taken or expires.
+        """
+        if session_id in self.pending_inputs:
+            metrics.rejected_inputs["coalesced"] += 1
+        self.pending_inputs[session_id] = (direction, self.clock() + TURN_BUFFER_TIME, seq)
+        if self.recorder is not None:
+            self.recorder.move(session_id, direction)
+    
+    def apply_inputs(self, current_time):
+        """Take each buffered turn at the first step where it is legal.
+        
+        Like arcade cornering: while the turn is blocked the player keeps
+        going in its last direction, until the turn opens up or expires.
+        """
+        pending = self.pending_inputs
+        for sid, (direction, expires, seq) in list(pending.items()):
+            player = self.players.get(sid)
+            if player is None or not player.alive or current_time > expires:
+                del pending[sid]
+                if player is not None and seq is not None:
+                    player.input_ack = seq
+                continue
+            # Keep the turn buffered until the speed throttle lets a step through
+            if not self.can_move(player, current_time):
+                continue
+            if self.step_target(player, direction) >= 0:
+                del pending[sid]
+                self.move_player(player, direction)
+                if seq is not None:
+                    player.input_ack = seq
+            elif player.direction and self.step_target(player, player.direction) >= 0:
+                self.move_player(player, player.direction)
+    
+    def game_tick(self):
+        """Advance the game by one server tick"""
+        if self.restart_requested:
+            self.restart_requested = False
+            if self.game_over:
+                self.reset_game()
+                self.pending_inputs.clear()
+            return
+        
+        if self.game_over:
+            return
+        
+        current_time = self.clock()
+        start = metrics.phase_start()
+        self.apply_inputs(current_time)
+        metrics.phase_end("move_player", start)
+        
+        # AI ghosts keep their own, slower pace
+        if current_time - self.ai_ghost_timer >= AI_GHOST_UPDATE_INTERVAL:
+            self.ai_ghost_timer = current_time
+            
+            # Toggle ghost mode every 20 seconds
+            if current_time - self.ghost_mode_timer > 20:
+                self.ghost_mode = "chase" if self.ghost_mode == "scatter" else "scatter"
+                self.ghost_mode_timer = current_time
+            
+            start = metrics.phase_start()
+            self.move_ai_ghosts()
+            metrics.phase_end("move_ai_ghost", start, len(self.ai_ghosts))
+        
+        self.update_fruits()
+        start = metrics.phase_start()
+        self.check_collisions()
+        metrics.phase_end("check_collisions", start)
+    
+    def record_tick(self, duration):
+        """Update tick timing metrics"""
+        stats = self.tick_stats
+        ms = duration * 1000
+        stats["ticks"] += 1
+        stats["last_ms"] = ms
+        stats["max_ms"] = max(stats["max_ms"], ms)
+        # Exponential moving average keeps this O(1)
+        stats["avg_ms"] += (ms - stats["avg_ms"]) * 0.05
+        stats["headroom_ms"] = stats["budget_ms"] - ms
+        overrun = ms > stats["budget_ms"]
+        if overrun:
+            stats["overruns"] += 1
+        metrics.observe_tick(duration, overrun)
+    
+    async def tick_loop(self):
+        """Fixed-rate authoritative game loop: one simulation step and one broadcast per tick"""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        
+        while True:
+            next_tick += TICK_INTERVAL
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > TICK_INTERVAL:
+                # Fell more than a whole tick behind; don't try to catch up in a burst
+                next_tick = loop.time()
+            
+            if not self.players:
+                continue
+            
+            start = time.perf_counter()
+            self.clock.set(time.time())
+            recorder = self.recorder
+            try:
+                if recorder is not None:
+                    recorder.tick(self.clock())
+                self.game_tick()
+                if recorder is not None and recorder.wants_check():
+                    recorder.check(self.state_checksum())
+                if self.game_over != (self.state == ROOM_GAME_OVER):
+                    self.set_state(ROOM_GAME_OVER if self.game_over else ROOM_RUNNING)
+                    if self.game_over:
+                        self.record_match("cleared" if not self.pellet_positions else "caught")
+                self.broadcast_game_state()
+                self.spectator_ticks += 1
+                if self.spectator_ticks >= SPECTATOR_INTERVAL and self.spectator_count():
+                    self.spectator_ticks = 0
+                    self.publish_spectator_frame()
+            except Exception:
+                self.report_tick_error(start)
+            self.record_tick(time.perf_counter() - start)
+    
+    def report_tick_error(self, now):
+        """Print the traceback, at most once per TICK_ERROR_INTERVAL so a room failing every tick can't flood the log"""
+        if self.tick_error_logged is not None and now - self.tick_error_logged < TICK_ERROR_INTERVAL:
+            self.tick_errors_suppressed += 1
+            return
+        repeats = f" ({self.tick_errors_suppressed} more since the last report)" if self.tick_errors_suppressed else ""
+        print(f"Tick error in room {self.room_id}{repeats}:")
+        traceback.print_exc()
+        self.tick_error_logged = now
+        self.tick_errors_suppressed = 0
+    
+    def state_checksum(self):
+        """CRC of the simulated state, compared by replays to detect divergence"""
+        parts = [self.board, self.ghost_mode.encode()]
+        for p in self.players.values():
+            parts.append(repr((p.sid, p.x, p.y, p.score, p.lives, p.alive, p.powered_up_until,
+                               p.direction)).encode())
+        for ghost in self.ai_ghosts:
+            parts.append(repr((ghost.x, ghost.y, ghost.in_pen)).encode())
+        parts.append(repr([(f["x"], f["y"], f["type"]) for f in self.fruits]).encode())
+        return zlib.crc32(b"".join(parts))
+    
+    def request_restart(self):
+        """Ask for a reset at the next tick; it only happens if the game is over"""
+        self.restart_requested = True
+        if self.recorder is not None:
+            self.recorder.restart()
+    
+    # ----- Match stats -----
+    def match_row(self, player, finished=True):
+        """One player's results, as stored by stats.StatsStore"""
+        entry = self.lobby.members.get(player.sid)
+        return {
+            "name": entry["name"] if entry else player.char,
+            "char": player.char,
+            "role": player.role_name,
+            "score": player.score,
+            "ghosts_eaten": player.ghosts_eaten,
+            "fruits_eaten": player.fruits_eaten,
+            "lives_lost": player.lives_lost,
+            "won": player is self.winner,
+            "finished": finished,
+        }
+    
+    def record_match(self, outcome):
+        """Hand the game that just ended to the stats store; it writes it later, off the loop"""
+        if stats_store is None:
+            return
+        players = self.departed + [self.match_row(p) for p in self.players.values()]
+        self.departed = []
+        if not players:
+            return
+        winner = self.lobby.members.get(self.winner.sid) if self.winner else None
+        stats_store.record_match({
+            "room_id": self.room_id,
+            "map": self.map_name,
+            "started_at": self.match_started,
+            "ended_at": self.clock(),
+            "outcome": outcome,
+            "winner": winner["name"] if winner else None,
+            "players": players,
+        })
+    
+    # ----- Lifecycle -----
+    @property
+    def game_started(self):
+        return self.state != ROOM_LOBBY
+    
+    def set_state(self, state):
+        self.state = state
+        self.state_since = time.monotonic()
+    
+    def expiry(self, now):
+        """Why the room should be torn down at ``now``, or None to keep it"""
+        if self.state == ROOM_GAME_OVER and now - self.state_since > GAME_OVER_TIMEOUT:
+            return "game_over"
+        if now - self.last_activity > ROOM_IDLE_TIMEOUT:
+            return "idle"
+        return None
+    
+    def begin(self):
+        """Start the simulation at the current game clock"""
+        self.set_state(ROOM_RUNNING)
+        self.ghost_mode_timer = self.clock()
+        self.match_started = self.clock()
+    
+    def start(self):
+        """Lock the lobby, tell its members and start ticking"""
+        self.clock.set(time.time())
+        self.begin()
+        if RECORD_DIR:
+            os.makedirs(RECORD_DIR, exist_ok=True)
+            self.recorder = replay.Recorder(os.path.join(RECORD_DIR, f"{self.room_id}.pmr"),
+                                            self.seed, self.clock(), self.map_name, self.room_id)
+            # Anyone already on the game socket joined before the recording began
+            for sid, player in self.players.items():
+                self.recorder.join(sid, player.role_name)
+        # Members get the same grace window to open their game socket as a dropped player to resume
+        deadline = time.monotonic() + RECONNECT_GRACE
+        for sid in self.lobby.members:
+            self.lobby.send(sid, {"start_game": True, "session_id": sid})
+            if sid not in self.players:
+                self.disconnected[sid] = deadline
+        if self.tick_task is None:
+            self.tick_task = asyncio.create_task(self.tick_loop())
+    
+    def stop(self):
+        """Tear down: stop ticking and close every socket still attached"""
+        if self.state == ROOM_RUNNING:
+            self.record_match("abandoned")
+        self.set_state(ROOM_CLOSED)
+        self.lobby.close()
+        for conn in self.conns.values():
+            conn.close(code=1001)  # Going away
+        for conns in self.spectators.values():
+            for conn in conns:
+                conn.close(code=1001)
+            conns.clear()
+        if self.feed_task is not None:
+            self.feed_task.cancel()
+            self.feed_task = None
+        self.disconnected.clear()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.tick_task is not None:
+            self.tick_task.cancel()
+            self.tick_task = None
+    
+    def is_empty(self):
+        return not self.lobby.members and not self.players
+
+# ===== ROOM REGISTRY =====
+stats_store = None  # stats.StatsStore while STATS_DIR is set
+rooms: Dict[str, GameRoom] = {}
+session_rooms: Dict[str, GameRoom] = {}  # session_id -> room it joined
+open_rooms: Dict[str, GameRoom] = {}  # map name -> room whose lobby new sessions join
+
+def get_open_room(map_name=DEFAULT_MAP):
+    """Room on ``map_name`` still accepting players in its lobby, creating one if needed"""
+    room = open_rooms.get(map_name)
+    if room is None or room.game_started or room.lobby.full():
+        room = GameRoom(ID_PREFIX + uuid.uuid4().hex[:8], map_name)
+        rooms[room.room_id] = room
+        open_rooms[map_name] = room
+    return room
+
+def close_room(room, reason="empty"):
+    """Stop a room's tick task and drop it and its sessions from the registry"""
+    metrics.rooms_closed[reason] += 1
+    room.stop()
+    rooms.pop(room.room_id, None)
+    if open_rooms.get(room.map.name) is room:
+        del open_rooms[room.map.name]
+    for sid in room.lobby.members:
+        if session_rooms.get(sid) is room:
+            del session_rooms[sid]
+
+def release_session(session_id):
+    """Forget a lobby session and close its room once nobody is left"""
+    room = session_rooms.pop(session_id, None)
+    if room is not None and room.is_empty():
+        close_room(room)
+
+def end_session(room, session_id):
+    """A session is gone for good: out of the game, the lobby and the registry"""
+    room.remove_player(session_id)
+    room.lobby.leave(session_id)
+    release_session(session_id)
+
+async def sweep_rooms():
+    """Ping idle game sockets, end sessions past their grace window and close idle rooms"""
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        now = time.monotonic()
+        for room in list(rooms.values()):
+            for conn in room.conns.values():
+                conn.keep_alive()
+            for sid in room.expired_sessions(now):
+                end_session(room, sid)
+            if room.state == ROOM_CLOSED:
+                continue  # The last session just left
+            reason = room.expiry(now)
+            if reason is not None:
+                close_room(room, reason)
 
 # ===== HTTP ROUTE =====
 @app.get("/")
 async def index():
     return FileResponse("index.html")
 
+@app.get("/stats/tick")
+async def get_tick_stats():
+    return {room_id: room.tick_stats for room_id, room in rooms.items() if room.game_started}
+
+@app.get("/stats/connections")
+async def get_connection_stats():
+    return {
+        room_id: {sid: conn.stats() for sid, conn in room.conns.items()}
+        for room_id, room in rooms.items()
+    }
+
+@app.get("/rooms")
+async def list_rooms():
+    return [
+        {
+            "room_id": room.room_id,
+            "map": room.map.name,
+            "started": room.game_started,
+            "state": room.state,
+            "lobby": len(room.lobby.members),
+            "players": len(room.players),
+            "spectators": room.spectator_count(),
+        }
+        for room in rooms.values()
+    ]
+
+@app.get("/leaderboard")
+async def get_leaderboard(map_name: str = Query(stats.ALL_MAPS, alias="map"), limit: int = 10):
+    """Best single-game scores, from the in-memory cache; ?map= for one map"""
+    if stats_store is None:
+        return []
+    return stats_store.top(map_name, min(limit, stats.LEADERBOARD_SIZE))
+
+@app.get("/maps")
+async def list_maps():
+    return [
+        {
+            "name": cmap.name,
+            "width": cmap.width,
+            "height": cmap.height,
+            "pellets": len(cmap.pellet_cells),
+            "ai_ghosts": len(cmap.ai_ghost_spawns),
+        }
+        for cmap in MAPS.values()
+    ]
+
+@app.get("/metrics")
+async def get_metrics():
+    started = [room for room in rooms.values() if room.game_started]
+    states = Counter(room.state for room in rooms.values())
+    gauges = {
+        "rooms": ("Rooms by state", [({"state": state}, states[state]) for state in ROOM_STATES[:-1]]),
+        "connected_sockets": ("Open client sockets", [
+            ({"socket": "lobby"}, sum(len(room.lobby.conns) for room in rooms.values())),
+            ({"socket": "game"}, sum(len(room.conns) for room in rooms.values())),
+            ({"socket": "watch"}, sum(room.spectator_count() for room in rooms.values())),
+        ]),
+        "disconnected_sessions": ("Sessions held for a reconnect within the grace window",
+                                  [({}, sum(len(room.disconnected) for room in rooms.values()))]),
+        "tracked_sessions": ("Sessions in the session registry", [({}, len(session_rooms))]),
+        "lobby_players": ("Sessions waiting in a lobby that hasn't started",
+                          [({}, sum(len(room.lobby.members) for room in rooms.values() if not room.game_started))]),
+        "send_queue_depth": ("Frames queued on all game sockets",
+                             [({}, sum(len(conn.queue) for room in started for conn in room.conns.values()))]),
+    }
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profile")
+async def get_profile(seconds: float = 10.0, interval_ms: float = 5.0):
+    """Sample the event loop thread's stacks; off unless PROFILER=1"""
+    if not PROFILER_ENABLED:
+        return PlainTextResponse("Profiler disabled; start the server with PROFILER=1\n", status_code=404)
+    loop_thread = threading.get_ident()
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    stacks = await asyncio.to_thread(metrics.sample_stacks, loop_thread, seconds, max(interval_ms, 1.0) / 1000)
+    return PlainTextResponse(stacks)
+
 # ===== LOBBY WEBSOCKET =====
 @app.websocket("/lobby")
 async def lobby_ws(ws: WebSocket):
-    global game_started
     await ws.accept()
     
-    if game_started:
-        await ws.send_json({"error": "Game already started"})
+    map_name = ws.query_params.get("map", DEFAULT_MAP)
+    if map_name not in MAPS:
+        await ws.send_json({"error": f"Unknown map {map_name!r}"})
         await ws.close()
         return
-
-    session_id = str(uuid.uuid4())
-    lobby[session_id] = {"name": f"Player{len(lobby)+1}", "role": None}
-    session_to_ws[session_id] = ws
-
-    async def send_lobby():
-        data = [{"name": p["name"], "role": p["role"]} for p in lobby.values()]
-        for sid in list(lobby.keys()):
-            try:
-                client_ws = session_to_ws.get(sid)
-                if client_ws:
-                    await client_ws.send_json({
-                        "lobby": data,
-                        "roles_taken": roles_taken,
-                        "session_id": sid,
-                        "can_select_pacman": can_select_role("Pac-Man"),
-                        "can_select_ghost": can_select_role("Ghost")
-                    })
-            except:
-                pass
-
-    await send_lobby()
+    room = get_open_room(map_name)
+    lobby = room.lobby
+    
+    session_id = ID_PREFIX + str(uuid.uuid4())
+    conn = ClientConnection(ws)
+    entry = lobby.join(session_id, conn)
+    session_rooms[session_id] = room
+    room.last_activity = time.monotonic()
+    lobby.send(session_id, {"session_id": session_id, "name": entry["name"]})
 
     try:
         while True:
             msg = await ws.receive_json()
+            metrics.messages_in["lobby"] += 1
+            if room.game_started:
+                continue
+            room.last_activity = time.monotonic()
             
-            if "role" in msg and msg["role"] in ["Pac-Man", "Ghost"]:
-                if not can_select_role(msg["role"]):
-                    await ws.send_json({
+            if "role" in msg and msg["role"] in ROLE_IDS:
+                if not lobby.can_select_role(msg["role"]):
+                    lobby.send(session_id, {
                         "error": f"Cannot select {msg['role']}. Need {MAX_PACMAN_RATIO} ghosts per Pac-Man!"
                     })
                     continue
-                
-                old_role = lobby[session_id]["role"]
-                if old_role:
-                    roles_taken[old_role] -= 1
-                
-                lobby[session_id]["role"] = msg["role"]
-                roles_taken[msg["role"]] += 1
-                await send_lobby()
-
-            if all(p["role"] for p in lobby.values()) and len(lobby) > 0:
-                if roles_taken["Pac-Man"] == 0 or roles_taken["Ghost"] == 0:
-                    continue
-                    
-                game_started = True
-                for sid in lobby.keys():
-                    client_ws = session_to_ws.get(sid)
-                    if client_ws:
-                        await client_ws.send_json({"start_game": True, "session_id": sid})
-                break
+                lobby.set_role(session_id, msg["role"])
+                if lobby.all_ready():
+                    room.start()
                 
     except WebSocketDisconnect:
-        old_role = lobby[session_id]["role"]
-        if old_role:
-            roles_taken[old_role] -= 1
-        del lobby[session_id]
-        if session_id in session_to_ws:
-            del session_to_ws[session_id]
-        if not game_started:
-            await send_lobby()
+        pass
+    finally:
+        if room.game_started:
+            # The game socket owns the session now; it ends when the player does
+            lobby.drop_conn(session_id)
+        else:
+            lobby.leave(session_id)
+            release_session(session_id)
+            # The one still choosing may have been the last holdout
+            if lobby.all_ready():
+                room.start()
 
 # ===== GAME WEBSOCKET =====
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(ws: WebSocket, session_id: str):
     await ws.accept()
     
-    if session_id not in lobby:
+    room = session_rooms.get(session_id)
+    if room is None or session_id not in room.lobby.members or room.state == ROOM_CLOSED:
         await ws.send_text("Error: Invalid session")
         await ws.close()
         return
+    if room.state == ROOM_LOBBY:
+        await ws.send_text("Error: Game has not started")
+        await ws.close()
+        return
     
-    role = lobby[session_id]["role"]
-    char = player_chars[len(players) % len(player_chars)]
+    # Clients opt into the binary protocol with ?format=binary
+    wire_format = ws.query_params.get("format", "json")
+    if wire_format not in WIRE_FORMATS:
+        wire_format = "json"
+    conn = ClientConnection(ws)
+    # A session that dropped within the grace window picks up its player where it left it
+    if not room.resume_player(session_id, conn, wire_format):
+        room.add_player(session_id, conn, wire_format)
+    # Who we are and how fast we move, for client-side prediction
+    player = room.players[session_id]
+    conn.push_control(encode_json({
+        "type": "welcome",
+        "char": player.char,
+        "role": player.role_name,
+        "move_delay": PACMAN_SPEED if player.role == PACMAN else GHOST_SPEED,
+        "slow_move_delay": PACMAN_SPEED if player.role == PACMAN else GHOST_FRIGHTENED_SPEED,
+    }))
     
-    if role == "Pac-Man":
-        pacman_count = sum(1 for p in players.values() if p["role"] == "Pac-Man")
-        spawn_x, spawn_y = PACMAN_SPAWNS[pacman_count % len(PACMAN_SPAWNS)]
-    else:
-        ghost_count = sum(1 for p in players.values() if p["role"] == "Ghost")
-        spawn_x, spawn_y = GHOST_SPAWNS[ghost_count % len(GHOST_SPAWNS)]
-    
-    players[session_id] = {
-        "x": spawn_x,
-        "y": spawn_y,
-        "char": char,
-        "score": 0,
-        "role": role,
-        "ws": ws,
-        "powered_up_until": 0,
-        "ghosts_eaten_combo": 0,
-        "lives": STARTING_LIVES,
-        "is_alive": True,
-        "last_move_time": time.time()
-    }
+    # ?view=R limits updates to the area within R cells of the player's entity
+    view = ws.query_params.get("view")
+    if view is not None and view.isdigit():
+        room.add_viewer(session_id, int(view))
 
-    async def keep_alive():
-        try:
-            while True:
-                await asyncio.sleep(15)
-                await ws.send_json({"type": "ping"})
-        except:
-            return
-    
-    asyncio.create_task(keep_alive())
+    bucket = TokenBucket(INPUT_RATE, INPUT_BURST)
 
     try:
-        await broadcast_game_state()
         while True:
             msg = await ws.receive_json()
+            metrics.messages_in["game"] += 1
+            if not bucket.take():
+                # Over the rate limit: dropped before it touches game state
+                metrics.rejected_inputs["rate_limited"] += 1
+                continue
+            room.last_activity = bucket.updated  # take() just read the monotonic clock
             
+            # Inputs are only buffered here; game_tick applies them
             if msg.get("type") == "move" and msg.get("direction") in DIRECTIONS:
-                if not game_over:
-                    move_player(players[session_id], msg["direction"])
-                    check_collisions()
-                    await broadcast_game_state()
+                if not room.game_over:
+                    seq = msg.get("seq")
+                    if type(seq) is not int or not 0 <= seq < INPUT_SEQ_LIMIT:
+                        seq = None
+                    room.queue_move(session_id, msg["direction"], seq)
             
             elif msg.get("type") == "restart":
-                if game_over:
-                    reset_game()
-                    await broadcast_game_state()
+                if room.game_over:
+                    room.request_restart()
+            
+            # Client saw a sequence gap; send it a full board next tick
+            elif msg.get("type") == "resync":
+                room.needs_keyframe.add(session_id)
                 
     except WebSocketDisconnect:
-        if session_id in players:
-            del players[session_id]
-
-async def broadcast_game_state():
-    """Broadcast game state to all players"""
-    state = get_game_state()
-    
-    # Build score display
-    score_lines = []
-    for p in players.values():
-        # Only show lives for Pac-Man
-        if p['role'] == "Pac-Man":
-            line = f"{p['char']}: {p['score']} pts, Lives: {p['lives']} ({p['role']})"
-        else:  # Ghost
-            line = f"{p['char']}: {p['score']} pts ({p['role']})"
-        
-        if p['role'] == "Pac-Man" and p['char'] in state['power_status']:
-            ps = state['power_status'][p['char']]
-            if ps['powered']:
-                line += f" 💪 POWER! ({ps['time_left']}s)"
-                if ps['flashing']:
-                    line += " ⚠️"
-        
-        if not p.get('is_alive', True):
-            line += " [DEAD]"
-        
-        score_lines.append(line)
-    
-    # Add game info
-    info_lines = [
-        f"Level: {state['level']} | Pellets Left: {state['pellets_left']}"
-    ]
-    
-    if state['fruits']:
-        fruit_info = ", ".join([f"{f['name']} ({f['points']}pts)" for f in state['fruits']])
-        info_lines.append(f"Fruits: {fruit_info}")
-    
-    if state['game_over']:
-        if state['winner']:
-            info_lines.append(f"🎉 GAME OVER! Winner: {state['winner']} 🎉")
-        else:
-            info_lines.append("🎉 GAME OVER! 🎉")
-        info_lines.append("Send 'restart' to play again!")
-    
-    message = {
-        "type": "game_state",
-        "board": state['board'],
-        "scores": "\n".join(score_lines),
-        "info": "\n".join(info_lines),
-        "power_status": state['power_status'],
-        "game_over": state['game_over']
-    }
-    
-    for player in list(players.values()):
-        try:
-            await player["ws"].send_json(message)
-        except:
-            pass
+        pass
+    finally:
+        conn.close()
+        if room.state != ROOM_CLOSED:
+            room.detach_player(session_id, conn)
 
-# ===== AI GHOST LOOP =====
-async def ai_ghost_loop():
-    """Update AI ghosts periodically"""
-    global ghost_mode, ghost_mode_timer
+# ===== SPECTATOR WEBSOCKET =====
+@app.websocket("/watch/{room_id}")
+async def watch_ws(ws: WebSocket, room_id: str):
+    """Read-only view of a room: a low-rate keyframe stream shared by every spectator"""
+    await ws.accept()
     
-    await asyncio.sleep(2)
+    room = rooms.get(room_id)
+    if room is None or room.state == ROOM_CLOSED:
+        await ws.send_text("Error: Unknown room")
+        await ws.close()
+        return
     
-    while True:
-        await asyncio.sleep(AI_GHOST_UPDATE_INTERVAL)
-        
-        if game_over or not players:
-            continue
-        
-        # Toggle ghost mode every 20 seconds
-        if time.time() - ghost_mode_timer > 20:
-            ghost_mode = "chase" if ghost_mode == "scatter" else "scatter"
-            ghost_mode_timer = time.time()
-        
-        # Move AI ghosts
-        for i, ghost in enumerate(ai_ghosts):
-            behavior = GHOST_BEHAVIORS[i % len(GHOST_BEHAVIORS)]
-            move_ai_ghost(ghost, behavior)
-        
-        # Update fruits
-        update_fruits()
-        
-        # Check collisions
-        check_collisions()
-        
-        # Broadcast state
-        await broadcast_game_state()
+    wire_format = ws.query_params.get("format", "json")
+    if wire_format not in WIRE_FORMATS:
+        wire_format = "json"
+    # A one-frame queue: a spectator that can't keep up only ever gets the newest frame
+    conn = ClientConnection(ws, max_queue=1)
+    room.add_spectator(conn, wire_format)
+    
+    try:
+        # Spectators have nothing to say; read only to notice the disconnect
+        while (await ws.receive())["type"] != "websocket.disconnect":
+            metrics.messages_in["watch"] += 1
+    finally:
+        conn.close()
+        room.remove_spectator(conn, wire_format)
 
 # ===== START SERVER =====
 if __name__ == "__main__":
     import uvicorn
     
-    # Initialize AI ghosts
-    ai_ghosts = [
-        {"x": 12, "y": 13, "char": "B", "in_pen": False},  # Blinky
-        {"x": 13, "y": 13, "char": "P", "in_pen": False},  # Pinky
-        {"x": 14, "y": 13, "char": "I", "in_pen": False},  # Inky
-        {"x": 15, "y": 13, "char": "C", "in_pen": False},  # Clyde
-    ]
-    
     port = int(os.environ.get("PORT", 8000))
-    loop = asyncio.get_event_loop()
-    loop.create_task(ai_ghost_loop())
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # WORKERS=N runs N game processes behind a router instead of one process
+    worker_count = int(os.environ.get("WORKERS", 1))
+    if worker_count > 1:
+        import cluster
+        cluster.run(worker_count, port)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
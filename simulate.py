@@ -0,0 +1,162 @@
+"""Headless game simulation: step a room as fast as possible, no sockets or event loop.
+
+A ``Simulation`` is an ordinary ``GameRoom`` driven synchronously. Bots stand
+in for the players and queue a move every tick, the room's clock advances by
+one tick interval per step, and nothing is rendered or broadcast. With the
+same seed and settings a run is fully repeatable.
+
+Examples:
+    python simulate.py --ticks 20000 --pacmen 2 --ghosts 6 --ai-ghosts 16
+    python simulate.py --ticks 2000 --record /tmp/sim.pmr && python replay.py /tmp/sim.pmr
+"""
+import argparse
+import os
+import random
+import time
+
+import replay
+from server import DEFAULT_MAP, GHOST_NAMES, MAPS, TICK_INTERVAL, AIGhost, GameRoom
+
+DIRECTION_NAMES = ("up", "down", "left", "right")
+REVERSE = {"up": "down", "down": "up", "left": "right", "right": "left"}
+TURN_CHANCE = 0.1  # Chance a bot changes direction mid-corridor
+
+
+# ===== BOTS =====
+class Bot:
+    """Wanders the maze like a player holding arrow keys.
+
+    Keeps its heading along corridors, picks a new one at junctions and dead
+    ends, and rarely turns back.
+    """
+
+    def __init__(self, session_id, rng):
+        self.session_id = session_id
+        self.rng = rng
+        self.direction = rng.choice(DIRECTION_NAMES)
+
+    def choose(self, room, player):
+        open_dirs = [d for d in DIRECTION_NAMES if room.step_target(player, d) >= 0]
+        if not open_dirs:
+            return self.direction
+        ahead = self.direction in open_dirs
+        if ahead and len(open_dirs) <= 2 and self.rng.random() >= TURN_CHANCE:
+            return self.direction
+        forward = [d for d in open_dirs if d != REVERSE[self.direction]] or open_dirs
+        self.direction = self.rng.choice(forward)
+        return self.direction
+
+
+# ===== SIMULATION =====
+class Simulation:
+    """One room stepped synchronously with bot players.
+
+    ``ai_ghosts`` replaces the map's AI ghosts with that many, cycling over
+    its AI ghost spawns (or the pen when it has none). ``record`` writes a
+    replay log of the run; recordings assume the map's own AI ghosts.
+    """
+
+    def __init__(self, map_name=DEFAULT_MAP, pacmen=1, ghosts=4, ai_ghosts=None, seed=0, record=None,
+                 restart=True):
+        if record and ai_ghosts is not None:
+            raise ValueError("a recorded simulation must use the map's AI ghosts")
+        self.room = room = GameRoom(f"sim-{seed}", map_name, seed=seed)
+        self.restart = restart
+        room.clock.set(0.0)
+        room.begin()
+        if ai_ghosts is not None:
+            self.set_ai_ghosts(ai_ghosts)
+        if record:
+            room.recorder = replay.Recorder(record, room.seed, room.clock(), map_name, room.room_id)
+
+        # Bots draw from their own stream so they never perturb the game's RNG
+        bot_rng = random.Random(seed ^ 0x5EED)
+        self.bots = []
+        # Ghosts join first so the Pac-Man ratio never blocks a role
+        for i in range(ghosts + pacmen):
+            sid = f"bot{i}"
+            room.lobby.join(sid, None)
+            room.lobby.set_role(sid, "Ghost" if i < ghosts else "Pac-Man")
+            room.add_player(sid, None)
+            self.bots.append(Bot(sid, bot_rng))
+        self.ticks = 0
+        self.games_over = 0
+
+    def set_ai_ghosts(self, count):
+        room = self.room
+        for ghost in room.ai_ghosts:
+            room.vacate(("ai", ghost.slot), ghost.x, ghost.y)
+        spawns = room.map.ai_ghost_spawns or [
+            (x, y, GHOST_NAMES[i % len(GHOST_NAMES)][0]) for i, (x, y) in enumerate(room.map.ghost_spawns)
+        ]
+        room.ai_ghosts = []
+        for slot in range(count):
+            x, y, char = spawns[slot % len(spawns)]
+            room.ai_ghosts.append(AIGhost(slot, x, y, char))
+            room.occupy(("ai", slot), x, y)
+
+    def step(self, ticks=1):
+        """Advance ``ticks`` ticks; game time moves one tick interval per tick"""
+        room = self.room
+        recorder = room.recorder
+        for _ in range(ticks):
+            for bot in self.bots:
+                player = room.players[bot.session_id]
+                if player.alive and not room.game_over:
+                    room.queue_move(bot.session_id, bot.choose(room, player))
+            room.clock.set(room.clock() + TICK_INTERVAL)
+            if recorder is not None:
+                recorder.tick(room.clock())
+            room.game_tick()
+            if recorder is not None and recorder.wants_check():
+                recorder.check(room.state_checksum())
+            self.ticks += 1
+            if room.game_over and self.restart and not room.restart_requested:
+                self.games_over += 1
+                room.request_restart()
+
+    def run(self, ticks):
+        """Step ``ticks`` ticks and return timing totals"""
+        start = time.perf_counter()
+        self.step(ticks)
+        seconds = time.perf_counter() - start
+        return {
+            "ticks": ticks,
+            "seconds": seconds,
+            "ticks_per_second": ticks / seconds if seconds else float("inf"),
+            "games_over": self.games_over,
+        }
+
+    def close(self):
+        if self.room.recorder is not None:
+            self.room.recorder.close()
+            self.room.recorder = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--map", default=DEFAULT_MAP, choices=sorted(MAPS))
+    parser.add_argument("--ticks", type=int, default=10000)
+    parser.add_argument("--pacmen", type=int, default=1, help="Pac-Man bots")
+    parser.add_argument("--ghosts", type=int, default=4, help="ghost player bots")
+    parser.add_argument("--ai-ghosts", type=int, help="AI ghosts (default: the map's)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record", help="write a replay log to this path")
+    args = parser.parse_args()
+    if args.record and os.path.exists(args.record):
+        parser.error(f"{args.record} already exists; recordings are never appended to")
+
+    sim = Simulation(args.map, args.pacmen, args.ghosts, args.ai_ghosts, args.seed, args.record)
+    try:
+        result = sim.run(args.ticks)
+    finally:
+        sim.close()
+    game_seconds = result["ticks"] * TICK_INTERVAL
+    print(f"{result['ticks']} ticks ({game_seconds:.0f} s of game time) in {result['seconds']:.3f} s: "
+          f"{result['ticks_per_second']:.0f} ticks/s, {game_seconds / result['seconds']:.0f}x real time")
+    print(f"{result['games_over']} games over; scores "
+          f"{[p.score for p in sim.room.pacmen]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Persistent match results and an in-memory leaderboard.
+
+Results go to a SQLite file, but the game loop never waits on it:
+``record_match`` only appends to a pending batch and updates the leaderboard
+cache, and ``flush_loop`` writes the batch in a worker thread, one
+transaction every FLUSH_INTERVAL seconds. The leaderboard is read from the
+database once, when the store opens, and from then on is updated from each
+recorded match, so serving it never queries SQLite.
+
+Tables::
+
+    matches(id, room_id, map, started_at, ended_at, outcome, winner)
+    match_players(match_id, name, char, role, score, ghosts_eaten, fruits_eaten, lives_lost, won, finished)
+
+``outcome`` is "cleared" (every pellet eaten), "caught" (every Pac-Man lost
+its lives) or "abandoned" (the room closed mid-game). ``finished`` is 0 for
+players who left before the end.
+"""
+import asyncio
+import bisect
+import sqlite3
+import threading
+
+FLUSH_INTERVAL = 2.0  # Seconds between batched writes
+LEADERBOARD_SIZE = 100  # Best single-game scores kept per map and overall
+ALL_MAPS = ""  # Leaderboard key for every map together
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    room_id TEXT NOT NULL,
+    map TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    ended_at REAL NOT NULL,
+    outcome TEXT NOT NULL,
+    winner TEXT
+);
+CREATE TABLE IF NOT EXISTS match_players (
+    match_id INTEGER NOT NULL REFERENCES matches(id),
+    name TEXT NOT NULL,
+    char TEXT NOT NULL,
+    role TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    ghosts_eaten INTEGER NOT NULL,
+    fruits_eaten INTEGER NOT NULL,
+    lives_lost INTEGER NOT NULL,
+    won INTEGER NOT NULL,
+    finished INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS match_players_score ON match_players(score DESC);
+"""
+
+PLAYER_FIELDS = ("name", "char", "role", "score", "ghosts_eaten", "fruits_eaten", "lives_lost", "won", "finished")
+
+# Each map's best rows, oldest first among equal scores
+TOP_QUERY = f"""
+SELECT {", ".join(PLAYER_FIELDS)}, map, ended_at, room_id FROM (
+    SELECT p.*, m.map, m.ended_at, m.room_id,
+           ROW_NUMBER() OVER (PARTITION BY m.map ORDER BY p.score DESC, m.ended_at) AS rank
+    FROM match_players p JOIN matches m ON m.id = p.match_id
+    WHERE p.score > 0
+) WHERE rank <= ?
+"""
+
+
+def _score_order(entry):
+    return -entry["score"]
+
+
+class StatsStore:
+    """One worker's results database, its pending batch and the leaderboard cache"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self.write_lock = threading.Lock()  # A cancelled flush's thread may still be writing
+        self.pending = []  # Matches recorded since the last flush
+        self.leaderboard = {}  # map name, or ALL_MAPS -> best entries, highest score first
+
+    # ===== DATABASE (worker thread) =====
+    def open(self):
+        """Create the tables and load the leaderboard. Blocks; run it off the event loop."""
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        columns = PLAYER_FIELDS + ("map", "ended_at", "room_id")
+        rows = self.db.execute(TOP_QUERY, (LEADERBOARD_SIZE,)).fetchall()
+        for row in sorted(rows, key=lambda row: row[-2]):  # Oldest first, so ties keep that order
+            entry = dict(zip(columns, row))
+            entry["won"] = bool(entry["won"])
+            entry["finished"] = bool(entry["finished"])
+            self.add_to_leaderboard(entry)
+
+    def write(self, batch):
+        """Insert a batch of matches in one transaction"""
+        with self.write_lock, self.db:
+            for match in batch:
+                cursor = self.db.execute(
+                    "INSERT INTO matches (room_id, map, started_at, ended_at, outcome, winner) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (match["room_id"], match["map"], match["started_at"], match["ended_at"],
+                     match["outcome"], match["winner"]))
+                self.db.executemany(
+                    f"INSERT INTO match_players (match_id, {', '.join(PLAYER_FIELDS)}) "
+                    f"VALUES (?{', ?' * len(PLAYER_FIELDS)})",
+                    [(cursor.lastrowid, *(player[field] for field in PLAYER_FIELDS)) for player in match["players"]])
+
+    def close_db(self):
+        with self.write_lock:
+            self.db.close()
+            self.db = None
+
+    # ===== EVENT LOOP =====
+    def record_match(self, match):
+        """Queue a match for the next flush and put its scores on the leaderboard.
+
+        ``match`` has room_id, map, started_at, ended_at, outcome, winner and
+        players, a list of dicts with the PLAYER_FIELDS.
+        """
+        self.pending.append(match)
+        for player in match["players"]:
+            if player["score"] > 0:
+                self.add_to_leaderboard(dict(player, map=match["map"], ended_at=match["ended_at"],
+                                             room_id=match["room_id"]))
+
+    def add_to_leaderboard(self, entry):
+        for key in (entry["map"], ALL_MAPS):
+            board = self.leaderboard.setdefault(key, [])
+            if len(board) >= LEADERBOARD_SIZE and entry["score"] <= board[-1]["score"]:
+                continue
+            bisect.insort(board, entry, key=_score_order)
+            del board[LEADERBOARD_SIZE:]
+
+    def top(self, map_name=ALL_MAPS, limit=10):
+        return self.leaderboard.get(map_name, [])[:max(0, limit)]
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            await asyncio.to_thread(self.write, batch)
+        except sqlite3.Error as e:
+            # Dropped rather than retried, so a broken disk can't grow the batch forever
+            print(f"Stats write failed, {len(batch)} matches lost: {e}")
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    async def close(self):
+        await self.flush()
+        if self.db is not None:
+            await asyncio.to_thread(self.close_db)